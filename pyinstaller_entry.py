@@ -1,4 +1,8 @@
-from filemind.cli import app
+import multiprocessing
+
+from filemind.__main__ import main
 
 if __name__ == "__main__":
-    app()
+    # Required for the 'scan' process pool in the frozen executable.
+    multiprocessing.freeze_support()
+    main()
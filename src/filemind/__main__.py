@@ -0,0 +1,30 @@
+"""
+Entry point for the 'filemind' command and 'python -m filemind'.
+
+'filemind --version' is answered here, before the CLI module and its dependencies
+(typer, requests, the database and extraction modules) are imported, so it
+returns almost instantly.
+"""
+import sys
+
+VERSION_FLAGS = {"--version", "-v"}
+
+def _print_version():
+    """Prints the installed version, like the CLI's --version option."""
+    import importlib.metadata
+    try:
+        print(f"filemind version {importlib.metadata.version('filemind')}")
+    except importlib.metadata.PackageNotFoundError:
+        print("filemind version: (local source)")
+
+def main():
+    """Runs the FileMind CLI."""
+    if len(sys.argv) == 2 and sys.argv[1] in VERSION_FLAGS:
+        _print_version()
+        sys.exit(0)
+
+    from .cli import app
+    app(prog_name="filemind")
+
+if __name__ == "__main__":
+    main()
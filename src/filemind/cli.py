@@ -1,33 +1,35 @@
 from pathlib import Path
 import os
 import time
-from typing import List, Optional, Tuple
-from collections import defaultdict
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+from collections import Counter
+import contextlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import itertools
+import math
 import sys
+import threading
 import shutil
-import importlib.metadata
 # import subprocess # Not directly used by CLI, but useful for more complex scenarios
 
 import typer
-import requests # Used in version_check but also directly by upgrade command for clearer error handling
-from packaging.version import parse as parse_version # Used by upgrade command and version_check
 
-# Only import lightweight modules at the top level for fast startup
+# Only import lightweight modules at the top level for fast startup. 'extractor'
+# (pdfplumber, python-docx, tokenizers), 'version_check' and requests are imported
+# inside the functions that need them.
 from . import (
     config,
     database,
     hasher,
     repository,
-    extractor,
-    version_check,
 )
 
 def version_callback(value: bool):
     if value:
-        try:
-            version = importlib.metadata.version("filemind")
+        version = config.get_installed_version()
+        if version:
             typer.echo(f"filemind version {version}")
-        except importlib.metadata.PackageNotFoundError:
+        else:
             typer.echo("filemind version: (local source)")
         raise typer.Exit()
 
@@ -54,20 +56,81 @@ def main(
     """
     pass
 
-def _show_update_notification():
-    """Checks for a new version and prints a notification if available."""
+# Seconds a command waits at exit for the background update check to finish
+UPDATE_CHECK_TIMEOUT_SECONDS = 0.25
+
+class _UpdateCheck:
+    """A check for a new version, running in a background thread."""
+
+    def __init__(self, check_for_new_version):
+        self._result: Optional[Tuple[str, str]] = None
+        self._thread = threading.Thread(
+            target=self._run, args=(check_for_new_version,), name="filemind-update-check", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, check_for_new_version):
+        try:
+            self._result = check_for_new_version()
+        except Exception:
+            pass # Fail silently. This is a non-critical feature.
+
+    def result(self, timeout: float) -> Optional[Tuple[str, str]]:
+        """
+        Waits up to timeout seconds for the check to finish.
+
+        Returns:
+            (new_version, current_version) if a newer version was found, else None.
+        """
+        self._thread.join(timeout)
+        return self._result
+
+def _start_update_check() -> Optional[_UpdateCheck]:
+    """
+    Starts checking for a new version in a background thread, so the network
+    request overlaps with the command's work instead of delaying its exit.
+
+    Returns:
+        The running check, or None if it is disabled or unavailable.
+    """
+    # Nobody sees the notice in scripts and CI, so don't spend a request on it there
+    if os.environ.get("FILEMIND_NO_UPDATE_CHECK") or not sys.stdout.isatty():
+        return None
     try:
-        new_version_info = version_check.check_for_new_version()
-        if new_version_info:
-            new_version, current_version = new_version_info
-            typer.secho(
-                f"\n[notice] A new version of FileMind is available: {current_version} -> {new_version}",
-                fg=typer.colors.YELLOW,
-            )
-            typer.secho("         To upgrade, run 'filemind upgrade'", fg=typer.colors.YELLOW)
+        # Imported here rather than in the thread: scan forks worker processes, and a
+        # fork while another thread holds an import lock can deadlock the child.
+        from . import version_check # LAZY IMPORT
     except Exception:
-        # Fail silently. This is a non-critical feature.
-        pass
+        return None
+    return _UpdateCheck(version_check.check_for_new_version)
+
+def _show_update_notification(update_check: Optional[_UpdateCheck]):
+    """
+    Prints a notification if the background update check found a new version.
+    The notice is skipped if the check has not finished shortly after the command.
+    """
+    if update_check is None:
+        return
+    new_version_info = update_check.result(UPDATE_CHECK_TIMEOUT_SECONDS)
+    if new_version_info:
+        new_version, current_version = new_version_info
+        typer.secho(
+            f"\n[notice] A new version of FileMind is available: {current_version} -> {new_version}",
+            fg=typer.colors.YELLOW,
+        )
+        typer.secho("         To upgrade, run 'filemind upgrade'", fg=typer.colors.YELLOW)
+
+def _link_or_copy(src: str, dst: str) -> str:
+    """
+    Hardlinks a file, or copies it if that is not possible (e.g. across filesystems).
+    Used to set up the model assets, which are only ever read and replaced, never
+    modified in place, so sharing them with the source is safe.
+    """
+    try:
+        os.link(src, dst)
+        return dst
+    except OSError:
+        return shutil.copy2(src, dst)
 
 @app.command()
 def init():
@@ -77,15 +140,17 @@ def init():
     # LAZY IMPORT: only needed for init
     from . import vector_store
 
+    update_check = _start_update_check()
     typer.secho("Initializing FileMind...", fg=typer.colors.BLUE)
     
     # 1. Ensure application directory exists
-    config.APP_DIR.mkdir(parents=True, exist_ok=True)
-    config.MODEL_DIR.mkdir(parents=True, exist_ok=True)
+    config.ensure_app_dirs()
     typer.secho(f"Application data directory set up at: {config.APP_DIR}", fg=typer.colors.GREEN)
 
     # 2. Initialize database
     database.initialize_database()
+    if database.repair_interrupted_bulk_ingest():
+        typer.secho("Rebuilt the keyword index after an interrupted 'scan --bulk'.", fg=typer.colors.YELLOW)
     typer.secho(f"Database initialized at: {config.DB_PATH}", fg=typer.colors.GREEN)
 
     # 3. Handle model assets
@@ -113,7 +178,7 @@ def init():
                 # Ensure a clean copy
                 if config.MODEL_DIR.exists():
                     shutil.rmtree(config.MODEL_DIR) # Clean up existing model dir if incomplete
-                shutil.copytree(source_path, config.MODEL_DIR)
+                shutil.copytree(source_path, config.MODEL_DIR, copy_function=_link_or_copy)
                 typer.secho(f"Copied model assets to {config.MODEL_DIR}", fg=typer.colors.GREEN)
             except Exception as e:
                 typer.secho(f"ERROR: Failed to copy model assets from {source_path}: {e}", fg=typer.colors.RED)
@@ -123,89 +188,443 @@ def init():
             typer.secho("If running from source, ensure the 'assets/models' directory is populated.", fg=typer.colors.YELLOW)
             raise typer.Exit(1)
 
-    # 4. Initialize FAISS index file
+    # 4. Quantize the model to INT8 for faster CPU inference
+    if config.QUANTIZED_MODEL_PATH.exists():
+        typer.secho("Quantized model already exists. Skipping quantization.", fg=typer.colors.GREEN)
+    else:
+        typer.secho("Quantizing model to INT8...", fg=typer.colors.BLUE)
+        try:
+            from . import quantizer # LAZY IMPORT: needs the optional 'onnx' package
+            quantizer.quantize_model(onnx_model_path, config.QUANTIZED_MODEL_PATH)
+            typer.secho(f"Quantized model saved to {config.QUANTIZED_MODEL_PATH}", fg=typer.colors.GREEN)
+        except ImportError:
+            typer.secho("Skipping quantization: install 'filemind[init]' to enable it.", fg=typer.colors.YELLOW)
+
+    # 5. Initialize FAISS index file, upgrading it if it was saved in an older format
     vs = vector_store.get_vector_store()
+    if vs.migrated:
+        typer.secho(f"Migrated FAISS index to format version {vector_store.INDEX_FORMAT_VERSION}.", fg=typer.colors.GREEN)
     vs.save()
     typer.secho(f"FAISS index initialized at: {config.FAISS_INDEX_PATH}", fg=typer.colors.GREEN)
     
     typer.secho("\nFileMind initialization complete! You can now run 'filemind scan <directory>'", fg=typer.colors.GREEN)
-    _show_update_notification()
+    _show_update_notification(update_check)
 
-def _process_file(file_path: Path):
-    """Processes a single file for indexing."""
-    from . import embedder, vector_store # LAZY IMPORT
-    vs = vector_store.get_vector_store()
+# File extensions that 'scan' knows how to extract text from, i.e. the keys of
+# extractor.EXTRACTORS (not imported here, to keep startup fast).
+SUPPORTED_EXTENSIONS = frozenset({'.pdf', '.docx', '.txt'})
+
+# Directories that 'scan' never descends into: version control metadata and
+# dependency or build caches, which can hold huge numbers of irrelevant files.
+IGNORED_DIRECTORIES = frozenset({'.git', '.hg', '.svn', 'node_modules', '__pycache__'})
 
+# Number of chunks to accumulate across files before calling the embedder.
+EMBEDDING_BATCH_SIZE = 64
+
+# Minimum number of seconds between saves of the FAISS index during a scan. Files
+# are committed to the database batch by batch, so an interrupted scan would
+# otherwise leave them recorded without their vectors. The whole index is rewritten
+# on each save, so this is a time interval rather than a file count.
+CHECKPOINT_INTERVAL_SECONDS = 60
+
+# Number of files each scan worker may have queued or finished ahead of the embedder.
+FILES_IN_FLIGHT_PER_WORKER = 4
+
+# Ratio of index vectors to live chunks above which 'scan' suggests 'rebuild-index'.
+# Vectors of deleted or re-indexed chunks can't be removed from the HNSW index, and
+# every search has to over-fetch to make up for them.
+STALE_VECTOR_WARNING_RATIO = 2
+
+def _iter_supported_files(root: Path) -> Iterator[Tuple[Path, int, int]]:
+    """
+    Walks a directory tree and yields (path, size, mtime) for every supported file.
+    Uses os.scandir so unsupported entries are rejected by name, before any Path
+    object is built or stat() is called.
+
+    Symlinks are not followed, directories in IGNORED_DIRECTORIES are skipped, and
+    a file reachable through several hardlinks is only yielded once.
+    """
+    seen = set()
+    stack = [str(root)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue # Unreadable directory
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in IGNORED_DIRECTORIES:
+                        stack.append(entry.path)
+                    continue
+
+                name = entry.name
+                dot = name.rfind('.')
+                if dot <= 0 or name[dot:].lower() not in SUPPORTED_EXTENSIONS:
+                    continue
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue # Removed while walking
+
+                # st_ino is 0 where scandir can't provide it cheaply (Windows)
+                if stat.st_ino:
+                    file_id = (stat.st_dev, stat.st_ino)
+                    if file_id in seen:
+                        continue
+                    seen.add(file_id)
+                yield Path(entry.path), stat.st_size, int(stat.st_mtime)
+
+def _is_unchanged(file_path: Path, size: int, mtime: int, known_files: Dict[str, Tuple[int, int, Optional[str]]], verbose: bool = False) -> bool:
+    """
+    Returns True if the file is already indexed with the same size and mtime.
+    known_files is the result of repository.get_all_file_stats().
+    """
+    existing_file = known_files.get(str(file_path))
+    if not existing_file:
+        return False
+
+    db_size, db_mtime, _ = existing_file
+    if db_size == size and db_mtime == mtime:
+        if verbose:
+            typer.echo(f"  Skipping (unchanged): {file_path.name}")
+        return True
+
+    if verbose:
+        typer.echo(f"  Updating (changed): {file_path.name}")
+    return False
+
+def _start_model_warmup(num_threads: Optional[int] = None) -> threading.Thread:
+    """
+    Loads the embedding model in a background thread, so the (slow) ONNX session
+    creation overlaps with the workers preparing the first files.
+
+    Args:
+        num_threads: Threads for ONNX Runtime to use, instead of all cores.
+    """
+    # Imported here rather than in the thread, see _start_update_check()
+    from . import embedder # LAZY IMPORT
+
+    # Set before the thread starts, so it also applies if the first embedding call
+    # gets to load the model before the warmup does
+    embedder.EmbeddingModel.num_threads = num_threads
+
+    def warm_up():
+        try:
+            embedder.EmbeddingModel.get_instance()
+        except Exception:
+            pass # The first real embedding call loads the model again and reports the error
+
+    thread = threading.Thread(target=warm_up, name="filemind-model-warmup", daemon=True)
+    thread.start()
+    return thread
+
+# A file for _prepare_file: (path, size, mtime, known_hash, compute_hash), where
+# known_hash is the hash already stored for the file, if any
+FileInfo = Tuple[Path, int, int, Optional[str], bool]
+
+class PreparedFile(NamedTuple):
+    """A file hashed, extracted and chunked by _prepare_file, ready to be embedded."""
+    file_hash: Optional[str] # None when the file was not hashed
+    size: int
+    mtime: int
+    # None when the file's content is unchanged, i.e. it needs no re-indexing
+    chunks: Optional[List[str]]
+
+class SkippedFile(NamedTuple):
+    """A file _prepare_file could not read or extract, and why."""
+    reason: str
+
+def _prepare_file(file_info: FileInfo) -> Union[PreparedFile, SkippedFile]:
+    """
+    Hashes, extracts and chunks a single file.
+    Runs in a worker process, so it must not touch the database or the FAISS index.
+
+    Returns:
+        The PreparedFile, or a SkippedFile if the file disappeared, can't be read, or
+        its parser failed. Its chunks are None when the hash matches known_hash.
+    """
+    from . import extractor # LAZY IMPORT
+
+    file_path, size, mtime, known_hash, compute_hash = file_info
     try:
-        mtime = int(file_path.stat().st_mtime)
-        size = file_path.stat().st_size
+        file_hash = hasher.generate_file_hash(file_path, size) if compute_hash else None
+        if file_hash is not None and file_hash == known_hash:
+            return PreparedFile(file_hash, size, mtime, None)
+        text = extractor.extract_text(file_path)
     except FileNotFoundError:
-        typer.secho(f"    [WARN] Skipping (not found): {file_path}", fg=typer.colors.YELLOW)
-        return
+        return SkippedFile("not found")
+    except PermissionError:
+        return SkippedFile("permission denied")
+    except Exception as e:
+        # A malformed PDF or DOCX must not end the whole scan. The error is reduced
+        # to a string, as parser exceptions don't always survive pickling.
+        return SkippedFile(f"{type(e).__name__}: {e}")
+
+    chunks = list(extractor.chunk_text(text)) if text else []
+    return PreparedFile(file_hash, size, mtime, chunks)
+
+def _prepare_files(
+    executor: ProcessPoolExecutor,
+    workers: int,
+    files: List[FileInfo],
+) -> Iterator[Tuple[FileInfo, Union[PreparedFile, SkippedFile]]]:
+    """
+    Runs _prepare_file for each file in the pool and yields (file_info, result) pairs
+    as soon as each file is done, so one slow PDF doesn't hold back the files after it.
+    Only a few files per worker are in flight at once, so the workers can't race
+    far ahead of the embedder and pile up extracted text in memory.
+    """
+    remaining = iter(files)
+    in_flight = {
+        executor.submit(_prepare_file, file_info): file_info
+        for file_info in itertools.islice(remaining, workers * FILES_IN_FLIGHT_PER_WORKER)
+    }
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            file_info = in_flight.pop(future)
+            # Keep the window full: submit the next file before handing this one back
+            for next_file_info in itertools.islice(remaining, 1):
+                in_flight[executor.submit(_prepare_file, next_file_info)] = next_file_info
+            yield file_info, future.result()
+
+def _commit_file(file_path: Path, prepared: PreparedFile, verbose: bool = False) -> List[int]:
+    """
+    Writes a prepared file and its chunks to the database.
+
+    Returns:
+        The IDs of the inserted chunks, whose embeddings still need to be added to the index.
+    """
+    file_hash, size, mtime, chunks = prepared
+
+    if chunks is None:
+        # Touched, or only changed outside its text: keep the existing chunks and vectors
+        repository.update_file_stat(file_path, size, mtime, file_hash)
+        if verbose:
+            typer.echo(f"  Skipping (content unchanged): {file_path.name}")
+        return []
 
     existing_file = repository.get_file_by_path(file_path)
     if existing_file:
-        file_id, db_size, db_mtime = existing_file
-        if db_size == size and db_mtime == mtime:
-            typer.echo(f"  Skipping (unchanged): {file_path.name}")
-            return
-        else:
-            typer.echo(f"  Updating (changed): {file_path.name}")
-            repository.delete_file_and_chunks(file_id)
-            
-    file_hash = hasher.generate_file_hash(file_path)
+        repository.delete_file_and_chunks(existing_file[0])
     file_id = repository.add_file(file_path, file_hash, size, mtime)
-    
-    text = extractor.extract_text(file_path)
-    if not text:
-        typer.echo(f"  Skipping (no text): {file_path.name}")
-        return
-        
-    chunks = list(extractor.chunk_text(text))
+
     if not chunks:
-        return
+        if verbose:
+            typer.echo(f"  Skipping (no text): {file_path.name}")
+        return []
+
+    chunk_ids = repository.add_chunks_bulk(file_id, chunks)
+    if verbose:
+        typer.echo(f"    -> Indexed {len(chunks)} chunks: {file_path.name}")
+    return chunk_ids
 
-    embeddings = embedder.generate_embeddings(chunks)
-    repository.add_chunks_and_vectors(file_id, chunks, embeddings, vs)
-    typer.echo(f"    -> Indexed {len(chunks)} chunks.")
+def _embed_with_cache(chunks: List[str]):
+    """
+    Embeds chunks, reusing cached embeddings for any chunk whose exact text was
+    embedded before by the same model, so only new or edited chunks are run through it.
+    """
+    from . import embedder, vector_store # LAZY IMPORT
+    import numpy as np
+
+    model_id = embedder.EmbeddingModel.get_instance().model_id
+    content_hashes = [hasher.generate_content_hash(chunk) for chunk in chunks]
+    cached = repository.get_cached_embeddings(model_id, content_hashes)
+
+    embeddings = np.empty((len(chunks), vector_store.EMBEDDING_DIM), dtype=np.float32)
+    hits = [i for i, content_hash in enumerate(content_hashes) if content_hash in cached]
+    missing = [i for i, content_hash in enumerate(content_hashes) if content_hash not in cached]
+
+    if hits:
+        # Decode all cached FP16 vectors with a single frombuffer and cast
+        packed = b"".join(cached[content_hashes[i]] for i in hits)
+        embeddings[hits] = np.frombuffer(packed, dtype=np.float16).reshape(len(hits), -1)
+
+    if missing:
+        new_embeddings = embedder.generate_embeddings([chunks[i] for i in missing])
+        embeddings[missing] = new_embeddings
+        # Stored as FP16, the same precision the FAISS index keeps
+        packed = new_embeddings.astype(np.float16)
+        repository.add_cached_embeddings(model_id, [
+            (content_hashes[i], packed[row].tobytes())
+            for row, i in enumerate(missing)
+        ])
+    return embeddings
+
+def _flush_pending(pending: List[Tuple[Path, PreparedFile]], vs, verbose: bool = False):
+    """
+    Embeds the chunks of all pending files in a single call, then commits the files
+    to the database and their embeddings to the FAISS index.
+    """
+    all_chunks = [chunk for _, prepared in pending for chunk in prepared.chunks or ()]
+    embeddings = _embed_with_cache(all_chunks) if all_chunks else None
+
+    # One transaction per batch instead of one per file
+    with database.transaction():
+        chunk_ids = []
+        for file_path, prepared in pending:
+            chunk_ids.extend(_commit_file(file_path, prepared, verbose))
+        # The chunk IDs follow the same file and chunk order as all_chunks, so the
+        # whole batch goes into the index with a single add
+        if chunk_ids:
+            vs.add(embeddings, chunk_ids)
+    pending.clear()
 
 @app.command()
-def scan(directory: Path = typer.Argument(..., exists=True, file_okay=False, dir_okay=True, readable=True, resolve_path=True, help="The directory to scan.")):
+def scan(
+    directory: Path = typer.Argument(..., exists=True, file_okay=False, dir_okay=True, readable=True, resolve_path=True, help="The directory to scan."),
+    verbose: bool = typer.Option(False, "--verbose", "-v", help="Print what happened to each file."),
+    compute_hash: bool = typer.Option(True, "--hash/--no-hash", help="Hash file contents for 'duplicates'. Use --no-hash to skip it and run 'hash-missing' later."),
+    bulk: bool = typer.Option(False, "--bulk", help="Rebuild the keyword index once at the end instead of updating it per chunk. Faster for large scans."),
+):
     """Scans a directory, indexing new or modified files."""
+    from . import vector_store # LAZY IMPORT
+    from rich.progress import Progress, SpinnerColumn, BarColumn, MofNCompleteColumn, TimeRemainingColumn # LAZY IMPORT
+
+    update_check = _start_update_check()
     typer.secho(f"Starting scan of directory: {directory}", fg=typer.colors.BLUE)
     start_time = time.time()
     
     database.initialize_database()
-    supported_extensions = {'.pdf', '.docx', '.txt'}
+    if database.repair_interrupted_bulk_ingest():
+        typer.secho("Rebuilt the keyword index after an interrupted 'scan --bulk'.", fg=typer.colors.YELLOW)
     
-    files_to_process = [p for p in directory.rglob("*") if p.is_file() and p.suffix.lower() in supported_extensions]
-    
-    with typer.progressbar(files_to_process, label="Scanning files") as progress:
-        for file_path in progress:
-            _process_file(file_path)
-    
-    from . import vector_store # LAZY IMPORT
-    vector_store.get_vector_store().save()
+    files = list(_iter_supported_files(directory))
+    # One query for everything already indexed, instead of one lookup per file
+    known_files = repository.get_all_file_stats()
+    # Hashes are only needed for files that could have a duplicate, i.e. that share
+    # their size with another file; 'duplicates' hashes any others on demand. Files
+    # indexed before are hashed too, to tell a touched file from a modified one.
+    file_sizes = {file_path: size for file_path, (size, _, _) in known_files.items()}
+    file_sizes.update((str(file_path), size) for file_path, size, _ in files)
+    shared_sizes = {size for size, count in Counter(file_sizes.values()).items() if count > 1}
+
+    files_to_process: List[FileInfo] = []
+    for file_path, size, mtime in files:
+        if _is_unchanged(file_path, size, mtime, known_files, verbose):
+            continue
+        known_hash = known_files.get(str(file_path), (None, None, None))[2]
+        should_hash = compute_hash and (size in shared_sizes or str(file_path) in known_files)
+        files_to_process.append((file_path, size, mtime, known_hash, should_hash))
+
+    vs = vector_store.get_vector_store()
+    # Chunks committed after the last index checkpoint of an interrupted scan have no
+    # vectors, and their files look unchanged, so they are embedded first
+    unindexed_chunks = repository.count_chunks(after_id=vs.last_chunk_id)
+
+    # Check the model assets here, as a worker failing to load the tokenizer would
+    # only surface as a traceback from the process pool
+    model_assets = (config.MODEL_DIR / "model.onnx", config.MODEL_DIR / "tokenizer.json")
+    if (files_to_process or unindexed_chunks) and not all(path.exists() for path in model_assets):
+        typer.secho("ERROR: Model assets not found. Please run 'filemind init' first.", fg=typer.colors.RED)
+        raise typer.Exit(1)
+
+    # Workers may be forked while the warmup thread is still importing, so the
+    # extractor must already be loaded here rather than imported inside a worker
+    from . import extractor # LAZY IMPORT
+
+    # Hashing, extraction and chunking are independent per file, so they run in a
+    # process pool while this process embeds earlier files. Embedding and DB/FAISS
+    # writes stay in this process. Half of the cores go to the workers and the rest
+    # to ONNX Runtime, whose intra-op threads would otherwise compete with them.
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, cpu_count // 2)
+
+    # Only pay for loading the model when there is something to embed
+    warmup = _start_model_warmup(num_threads=max(1, cpu_count - workers)) if files_to_process or unindexed_chunks else None
+
+    if unindexed_chunks:
+        typer.secho(f"Indexing {unindexed_chunks} chunks left without vectors by an interrupted scan...", fg=typer.colors.YELLOW)
+        for batch in repository.iter_all_chunks_ordered(after_id=vs.last_chunk_id):
+            vs.add(_embed_with_cache([content for _, content in batch]), [chunk_id for chunk_id, _ in batch])
+        vs.save()
+
+    fts_updates = contextlib.ExitStack()
+    if bulk and files_to_process:
+        try:
+            fts_updates.enter_context(database.fts_triggers_disabled())
+        except RuntimeError as e: # Another 'scan --bulk' holds the marker
+            if warmup is not None:
+                warmup.join()
+            typer.secho(f"ERROR: {e}", fg=typer.colors.RED)
+            raise typer.Exit(code=1)
+    try:
+        with fts_updates, ProcessPoolExecutor(max_workers=workers) as executor:
+            results = _prepare_files(executor, workers, files_to_process)
+            pending = []
+            pending_chunks = 0
+            last_checkpoint = time.monotonic()
+            # A single progress bar refreshes at a fixed rate, instead of several
+            # console writes per file. Per-file output is only printed with --verbose.
+            with Progress(
+                SpinnerColumn(),
+                "[progress.description]{task.description}",
+                BarColumn(),
+                MofNCompleteColumn(),
+                TimeRemainingColumn(),
+            ) as progress:
+                task = progress.add_task("Indexing files", total=len(files_to_process))
+                for (file_path, *_), prepared in results:
+                    progress.update(task, description=file_path.name)
+                    if isinstance(prepared, SkippedFile):
+                        typer.secho(f"    [WARN] Skipping ({prepared.reason}): {file_path}", fg=typer.colors.YELLOW)
+                    else:
+                        chunks = prepared.chunks
+                        if chunks and str(file_path) in known_files and chunks == repository.get_chunk_contents(file_path):
+                            # Re-extracted without a matching hash (e.g. --no-hash), but the
+                            # text is the same: keep the chunk IDs, as new IDs would leave the
+                            # old vectors behind in the index
+                            prepared = prepared._replace(chunks=None)
+                        # Small files are buffered so the embedder sees reasonably sized batches.
+                        pending.append((file_path, prepared))
+                        pending_chunks += len(prepared.chunks or ())
+                        if pending_chunks >= EMBEDDING_BATCH_SIZE:
+                            _flush_pending(pending, vs, verbose)
+                            pending_chunks = 0
+                            if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL_SECONDS:
+                                vs.save()
+                                last_checkpoint = time.monotonic()
+                    progress.advance(task)
+                _flush_pending(pending, vs, verbose)
+                progress.update(task, description="Indexing files")
+    finally:
+        if warmup is not None:
+            warmup.join() # Don't exit while the session is still being created
+        # Also save when the scan fails part-way: files committed by earlier batches
+        # are recorded as indexed, so a later scan would skip them if their vectors
+        # were not on disk.
+        vs.save()
     
     end_time = time.time()
-    typer.secho(f"\nScan complete. Processed {len(files_to_process)} files in {end_time - start_time:.2f} seconds.", fg=typer.colors.GREEN)
-    _show_update_notification()
+    typer.secho(f"\nScan complete. Processed {len(files)} files in {end_time - start_time:.2f} seconds.", fg=typer.colors.GREEN)
+    if vs.ntotal > STALE_VECTOR_WARNING_RATIO * repository.count_chunks():
+        typer.secho("The search index holds many outdated vectors, which slows down searches. Run 'filemind rebuild-index' to compact it.", fg=typer.colors.YELLOW)
+    _show_update_notification(update_check)
 
 @app.command()
 def search(query: str = typer.Argument(...), top_k: int = typer.Option(5, "--top-k", "-k")):
     """Performs a hybrid search for files based on your query."""
     from . import embedder, vector_store # LAZY IMPORT
 
+    update_check = _start_update_check()
     typer.secho(f"Searching for: '{query}'...", fg=typer.colors.BLUE)
     database.initialize_database()
     
-    vs = vector_store.get_vector_store()
+    vs = vector_store.get_vector_store(readonly=True)
     query_embedding = embedder.generate_embeddings([query])
         
-    semantic_results = vs.search(query_embedding, k=top_k * 2)
+    # Vectors of deleted or re-indexed chunks stay in the index until 'rebuild-index'
+    # and are dropped when the hits are joined with the database, so fetch more
+    # neighbours in proportion to how many of the vectors are stale.
+    live_chunks = repository.count_chunks()
+    stale_factor = math.ceil(vs.ntotal / live_chunks) if live_chunks else 1
+    semantic_results = vs.search(query_embedding, k=min(top_k * 2 * max(1, stale_factor), max(1, vs.ntotal)))
     keyword_chunk_ids = repository.search_chunks_fts(query, limit=top_k * 2)
 
-    file_scores = repository.calculate_hybrid_scores(semantic_results, keyword_chunk_ids)
+    file_scores = repository.calculate_hybrid_scores(semantic_results, keyword_chunk_ids, top_k=top_k)
 
     typer.secho("\n--- Search Results ---", fg=typer.colors.GREEN)
     if not file_scores:
@@ -213,7 +632,7 @@ def search(query: str = typer.Argument(...), top_k: int = typer.Option(5, "--top
         return
 
     for i, (file_id, data) in enumerate(file_scores[:top_k]):
-        file_path = repository.get_file_path_by_id(file_id)
+        file_path = data["file_path"]
         if file_path:
             score_color = typer.colors.GREEN if data['score'] > 0.5 else typer.colors.YELLOW
             typer.secho(f"\n{i+1}. Path: ", fg=typer.colors.WHITE, nl=False)
@@ -224,24 +643,66 @@ def search(query: str = typer.Argument(...), top_k: int = typer.Option(5, "--top
                 typer.secho(" (Keyword Match)", fg=typer.colors.MAGENTA)
             else:
                 typer.echo("")
-    _show_update_notification()
+    _show_update_notification(update_check)
+
+def _hash_files(files: List[Tuple[int, str, int]], label: str) -> int:
+    """
+    Hashes the given (id, file_path, file_size) files and stores their hashes.
+
+    Returns:
+        The number of files hashed.
+    """
+    updates = []
+    hashes = hasher.hash_files((Path(file_path), file_size) for _, file_path, file_size in files)
+    with typer.progressbar(zip(files, hashes), length=len(files), label=label) as progress:
+        for (file_id, file_path, _), file_hash in progress:
+            if file_hash is None:
+                typer.secho(f"\n    [WARN] Skipping (not readable): {file_path}", fg=typer.colors.YELLOW)
+                continue
+            updates.append((file_hash, file_id))
+    repository.update_file_hashes(updates)
+    return len(updates)
+
+@app.command(name="hash-missing")
+def hash_missing():
+    """Hashes indexed files that were scanned with --no-hash or use an older hash algorithm."""
+    typer.secho("Looking for files without a current hash...", fg=typer.colors.BLUE)
+    database.initialize_database()
+    files = repository.get_files_missing_hash()
+
+    if not files:
+        typer.secho("All files are already hashed.", fg=typer.colors.GREEN)
+        return
+
+    start_time = time.time()
+    hashed = _hash_files(files, "Hashing files")
+    end_time = time.time()
+    typer.secho(f"\nHashed {hashed} files in {end_time - start_time:.2f} seconds.", fg=typer.colors.GREEN)
 
 @app.command()
 def duplicates():
     """Finds and lists files that are exact duplicates based on their content hash."""
+    update_check = _start_update_check()
     typer.secho("Searching for duplicate files...", fg=typer.colors.BLUE)
     database.initialize_database()
-    duplicate_hashes = repository.find_duplicate_hashes()
 
-    if not duplicate_hashes:
+    # Files with a unique size can't have a duplicate, so only files that share their
+    # size with another one and have no current hash yet need to be hashed now.
+    unhashed = repository.get_files_missing_hash(only_shared_sizes=True)
+    if unhashed:
+        _hash_files(unhashed, "Hashing candidates")
+
+    found = False
+    for file_hash, rows in repository.iter_duplicate_groups():
+        found = True
+        typer.secho(f"\nHash: {file_hash} (found {len(rows)} times)", fg=typer.colors.YELLOW)
+        for _, file_path, _, _ in rows:
+            typer.echo(f"  - {file_path}")
+
+    if not found:
         typer.secho("No exact duplicate files found.", fg=typer.colors.GREEN)
         return
-
-    for file_hash, count in duplicate_hashes:
-        typer.secho(f"\nHash: {file_hash} (found {count} times)", fg=typer.colors.YELLOW)
-        for file_info in repository.get_files_by_hash(file_hash):
-            typer.echo(f"  - {file_info[0]}")
-    _show_update_notification()
+    _show_update_notification(update_check)
 
 @app.command(name="rebuild-index")
 def rebuild_index():
@@ -255,55 +716,64 @@ def rebuild_index():
         raise typer.Abort()
 
     from . import embedder, vector_store # LAZY IMPORT
-    import faiss
+    import numpy as np
 
+    update_check = _start_update_check()
     typer.secho("Starting index rebuild...", fg=typer.colors.BLUE)
     start_time = time.time()
 
     database.initialize_database()
-    all_chunks = repository.get_all_chunks_ordered()
+    total_chunks = repository.count_chunks()
 
-    if not all_chunks:
+    if not total_chunks:
         typer.secho("No chunks found in the database. Nothing to rebuild.", fg=typer.colors.YELLOW)
-        new_index = faiss.IndexFlatIP(vector_store.EMBEDDING_DIM)
-        faiss.write_index(new_index, str(config.FAISS_INDEX_PATH))
+        vector_store.write_index(vector_store.create_index(), last_chunk_id=0)
         raise typer.Exit()
 
-    new_index = faiss.IndexFlatIP(vector_store.EMBEDDING_DIM)
+    new_index = vector_store.create_index()
     
     batch_size = 500
-    total_chunks = len(all_chunks)
+    # Every batch is embedded into this one buffer, which FAISS then copies from
+    embedding_buffer = np.empty((batch_size, vector_store.EMBEDDING_DIM), dtype=np.float32)
     
-    with typer.progressbar(range(0, total_chunks, batch_size), label="Re-embedding chunks") as progress:
-        for i in progress:
-            batch = all_chunks[i : i + batch_size]
+    # Chunks are streamed from the database, so memory use doesn't grow with the corpus
+    with typer.progressbar(length=total_chunks, label="Re-embedding chunks") as progress:
+        for batch in repository.iter_all_chunks_ordered(batch_size):
             chunk_content = [c[1] for c in batch]
             
-            embeddings = embedder.generate_embeddings(chunk_content)
-            new_index.add(embeddings)
+            embeddings = embedder.generate_embeddings(chunk_content, out=embedding_buffer[:len(batch)])
+            new_index.add_with_ids(embeddings, np.array([c[0] for c in batch], dtype=np.int64))
+            last_chunk_id = batch[-1][0]
+            progress.update(len(batch))
     
-    temp_index_path = config.FAISS_INDEX_PATH.with_suffix(".tmp")
-    faiss.write_index(new_index, str(temp_index_path))
-    shutil.move(str(temp_index_path), str(config.FAISS_INDEX_PATH))
+    vector_store.write_index(new_index, last_chunk_id)
+
+    # The cache would otherwise keep the embeddings of every chunk text ever indexed
+    removed = repository.prune_embedding_cache(embedder.EmbeddingModel.get_instance().model_id)
+    if removed:
+        typer.secho(f"Removed {removed} unused cached embeddings.", fg=typer.colors.GREEN)
 
     end_time = time.time()
     typer.secho(f"\nIndex rebuild complete. Processed {total_chunks} chunks in {end_time - start_time:.2f} seconds.", fg=typer.colors.GREEN)
-    _show_update_notification()
+    _show_update_notification(update_check)
     
 @app.command()
 def upgrade():
     """Checks for and provides instructions to upgrade FileMind."""
+    # LAZY IMPORT: requests alone takes ~80 ms to import and only 'upgrade' uses it here
+    import requests
+    from packaging.version import parse as parse_version
     
     typer.secho("Checking for new versions...", fg=typer.colors.BLUE)
 
-    try:
-        current_version_str = importlib.metadata.version("filemind")
-        current_version = parse_version(current_version_str)
-    except importlib.metadata.PackageNotFoundError:
+    current_version_str = config.get_installed_version()
+    if current_version_str is None:
         typer.secho("Could not determine current version (running from source?).", fg=typer.colors.YELLOW)
         return
+    current_version = parse_version(current_version_str)
 
     try:
+        from . import version_check # LAZY IMPORT
         new_version_info = version_check.check_for_new_version() # Reuse check_for_new_version logic
         if new_version_info:
             latest_version_str, _ = new_version_info
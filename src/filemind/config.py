@@ -1,25 +1,49 @@
 from pathlib import Path
+from functools import lru_cache
+from typing import Optional
+import importlib.metadata
 import os
+import sys
 
+@lru_cache(maxsize=None)
 def get_app_dir() -> Path:
     """
     Gets the application's data directory.
     On Windows, this is %LOCALAPPDATA%\FileMind.
     On macOS, this is ~/Library/Application Support/FileMind.
     On Linux, this is ~/.local/share/FileMind.
+
+    The directory is not created here, see ensure_app_dirs().
     """
-    if os.name == 'nt':  # Windows
-        app_dir = Path(os.getenv('LOCALAPPDATA', '')) / 'FileMind'
-    elif os.uname().sysname == 'Darwin':  # macOS
-        app_dir = Path.home() / 'Library' / 'Application Support' / 'FileMind'
+    if sys.platform == 'win32':  # Windows
+        return Path(os.getenv('LOCALAPPDATA', '')) / 'FileMind'
+    elif sys.platform == 'darwin':  # macOS
+        return Path.home() / 'Library' / 'Application Support' / 'FileMind'
     else:  # Linux and other UNIX-like systems
-        app_dir = Path.home() / '.local' / 'share' / 'FileMind'
-    
-    app_dir.mkdir(parents=True, exist_ok=True)
-    return app_dir
+        return Path.home() / '.local' / 'share' / 'FileMind'
+
+@lru_cache(maxsize=None)
+def get_installed_version() -> Optional[str]:
+    """
+    Returns the installed version of FileMind, or None when running from source.
+    Looking it up scans sys.path for the package metadata, so the result is cached.
+    """
+    try:
+        return importlib.metadata.version("filemind")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+def ensure_app_dirs():
+    """Creates the application and model directories if they don't exist yet."""
+    MODEL_DIR.mkdir(parents=True, exist_ok=True)
 
 APP_DIR = get_app_dir()
 DB_PATH = APP_DIR / "filemind.db"
 FAISS_INDEX_PATH = APP_DIR / "filemind.index"
+FAISS_INDEX_META_PATH = APP_DIR / "filemind.index.json"
+# Exists while a 'scan --bulk' runs with the keyword index triggers dropped, and is
+# locked by that scan. An unlocked marker was left behind by an interrupted one.
+BULK_INGEST_MARKER_PATH = APP_DIR / "bulk_ingest.lock"
 MODEL_DIR = APP_DIR / "models"
-MODEL_DIR.mkdir(parents=True, exist_ok=True)
+# INT8 copy of the model produced by 'filemind init'; preferred over model.onnx when present.
+QUANTIZED_MODEL_PATH = MODEL_DIR / "model_quantized.onnx"
@@ -1,15 +1,217 @@
+import atexit
+import os
 import sqlite3
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, Optional
 from . import config
 
+def _add_hash_algorithm_column(conn: sqlite3.Connection):
+    """Adds files.hash_algorithm. ALTER TABLE has no IF NOT EXISTS, so check first."""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(files)")]
+    if "hash_algorithm" not in columns:
+        conn.execute("ALTER TABLE files ADD COLUMN hash_algorithm TEXT NOT NULL DEFAULT 'sha256'")
+
+# Schema migrations, applied in order on top of the tables created below. Each is a
+# sequence of statements, or a function of the connection for steps that SQL can't
+# make idempotent. PRAGMA user_version records how many of them have already been
+# applied, and is bumped in the same transaction as each migration.
+MIGRATIONS = [
+    # 1: Record which algorithm produced each file hash. Existing rows are SHA-256.
+    _add_hash_algorithm_column,
+    # 2: Never reuse chunk IDs. They double as FAISS vector IDs, and vectors of deleted
+    #    chunks may linger in the index until 'rebuild-index'. The triggers dropped
+    #    along with the old table are recreated by initialize_database().
+    (
+        "DROP TABLE IF EXISTS chunks_new",
+        """
+        CREATE TABLE chunks_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_id INTEGER NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            FOREIGN KEY (file_id) REFERENCES files (id) ON DELETE CASCADE
+        )
+        """,
+        """
+        INSERT INTO chunks_new (id, file_id, chunk_index, content)
+            SELECT id, file_id, chunk_index, content FROM chunks
+        """,
+        "DROP TABLE chunks",
+        "ALTER TABLE chunks_new RENAME TO chunks",
+    ),
+    # 3: Cache embeddings by a hash of the chunk text, so re-indexing an edited file
+    #    only runs the model on chunks whose text actually changed.
+    (
+        """
+        CREATE TABLE IF NOT EXISTS chunk_cache (
+            content_hash BLOB PRIMARY KEY,
+            embedding BLOB NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ),
+    # 4: Allow files without a hash ('scan --no-hash'), to be filled in later by
+    #    'hash-missing'. Migrations run with foreign keys off, so dropping the old
+    #    table does not cascade to the chunks.
+    (
+        "DROP TABLE IF EXISTS files_new",
+        """
+        CREATE TABLE files_new (
+            id INTEGER PRIMARY KEY,
+            file_path TEXT NOT NULL UNIQUE,
+            file_hash TEXT,
+            hash_algorithm TEXT,
+            file_size INTEGER NOT NULL,
+            last_modified_time INTEGER NOT NULL,
+            indexed_at INTEGER NOT NULL
+        )
+        """,
+        """
+        INSERT INTO files_new (id, file_path, file_hash, hash_algorithm, file_size, last_modified_time, indexed_at)
+            SELECT id, file_path, file_hash, hash_algorithm, file_size, last_modified_time, indexed_at FROM files
+        """,
+        "DROP TABLE files",
+        "ALTER TABLE files_new RENAME TO files",
+    ),
+    # 5: Let 'duplicates' group files by hash without scanning the whole table.
+    ("CREATE INDEX IF NOT EXISTS idx_files_hash ON files (file_hash)",),
+    # 6: Only files sharing their size with another file can be duplicates, so
+    #    'duplicates' looks up size collisions first.
+    ("CREATE INDEX IF NOT EXISTS idx_files_size ON files (file_size)",),
+    # 7: Stem keyword matches ("reports" finds "report") and fold Unicode case and
+    #    diacritics. The index is rebuilt from 'chunks', its external content table,
+    #    so no chunk text is stored twice.
+    (
+        "DROP TABLE IF EXISTS chunks_fts",
+        """
+        CREATE VIRTUAL TABLE chunks_fts USING fts5(
+            content,
+            content='chunks',
+            content_rowid='id',
+            tokenize='porter unicode61'
+        )
+        """,
+        "INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')",
+    ),
+    # 8: Deleting a file cascades to its chunks, which SQLite looks up by file_id.
+    #    Without an index, every deleted or re-indexed file scanned all chunks.
+    ("CREATE INDEX IF NOT EXISTS idx_chunks_file_id ON chunks (file_id)",),
+    # 9: Key cached embeddings by the model that produced them as well, so switching
+    #    models never reuses stale vectors. Existing rows don't record their model,
+    #    so they are dropped.
+    (
+        "DROP TABLE IF EXISTS chunk_cache",
+        """
+        CREATE TABLE chunk_cache (
+            model_id TEXT NOT NULL,
+            content_hash BLOB NOT NULL,
+            embedding BLOB NOT NULL,
+            PRIMARY KEY (model_id, content_hash)
+        ) WITHOUT ROWID
+        """,
+    ),
+]
+
+# Triggers that keep the 'chunks_fts' full-text index in sync with 'chunks', by name
+FTS_TRIGGERS = {
+    "chunks_after_insert": """
+    CREATE TRIGGER IF NOT EXISTS chunks_after_insert
+    AFTER INSERT ON chunks
+    BEGIN
+        INSERT INTO chunks_fts(rowid, content) VALUES (new.id, new.content);
+    END;
+    """,
+    "chunks_after_delete": """
+    CREATE TRIGGER IF NOT EXISTS chunks_after_delete
+    AFTER DELETE ON chunks
+    BEGIN
+        INSERT INTO chunks_fts(chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END;
+    """,
+    "chunks_after_update": """
+    CREATE TRIGGER IF NOT EXISTS chunks_after_update
+    AFTER UPDATE ON chunks
+    BEGIN
+        INSERT INTO chunks_fts(chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO chunks_fts(rowid, content) VALUES (new.id, new.content);
+    END;
+    """,
+}
+
+_connection: Optional[sqlite3.Connection] = None
+# Whether initialize_database() has already run on the current connection
+_initialized = False
+
 def get_db_connection() -> sqlite3.Connection:
-    """Establishes a connection to the SQLite database."""
-    return sqlite3.connect(config.DB_PATH)
+    """
+    Returns the shared connection to the SQLite database, opening it on first use.
+    The connection is in autocommit mode; use transaction() to group writes.
+    """
+    global _connection
+    if _connection is None:
+        config.ensure_app_dirs()
+        _connection = sqlite3.connect(config.DB_PATH, isolation_level=None, check_same_thread=False)
+        # WAL lets readers proceed during writes, and with synchronous=NORMAL commits
+        # no longer fsync individually; the WAL is synced at checkpoints instead.
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.execute("PRAGMA temp_store=MEMORY")
+        # 64 MiB page cache (negative values are in KiB) instead of the default 2 MiB
+        _connection.execute("PRAGMA cache_size=-65536")
+        _connection.execute("PRAGMA mmap_size=268435456")
+        # Wait for a concurrent writer (e.g. a second 'scan') instead of failing at once
+        _connection.execute("PRAGMA busy_timeout=5000")
+        # Required for ON DELETE CASCADE. Must be set outside of any transaction.
+        _connection.execute("PRAGMA foreign_keys=ON")
+        atexit.register(close_db_connection)
+    return _connection
+
+def close_db_connection():
+    """Closes the shared connection, if open."""
+    global _connection, _initialized
+    if _connection is not None:
+        _connection.close()
+        _connection = None
+        _initialized = False
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """
+    Runs the enclosed statements in a single transaction.
+    Nested uses become savepoints, so a function that opens its own transaction can
+    also be called as part of a larger batch.
+    """
+    conn = get_db_connection()
+    if conn.in_transaction:
+        conn.execute("SAVEPOINT filemind")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK TO filemind")
+            conn.execute("RELEASE filemind")
+            raise
+        else:
+            conn.execute("RELEASE filemind")
+        return
+
+    # Take the write lock up front. A deferred transaction that starts by reading
+    # fails with SQLITE_BUSY, instead of waiting, if another writer gets there first.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
 
 def initialize_database():
     """
     Initializes the database by creating the necessary tables if they don't exist.
-    This function is idempotent.
+    This function is idempotent, and only does its work once per connection.
     """
+    global _initialized
+    if _initialized:
+        return
     conn = get_db_connection()
     cursor = conn.cursor()
 
@@ -46,34 +248,151 @@ def initialize_database():
     );
     """)
     
-    # Create a trigger to keep the FTS table synchronized with the chunks table
-    cursor.execute("""
-    CREATE TRIGGER IF NOT EXISTS chunks_after_insert
-    AFTER INSERT ON chunks
-    BEGIN
-        INSERT INTO chunks_fts(rowid, content) VALUES (new.id, new.content);
-    END;
-    """)
-    
-    cursor.execute("""
-    CREATE TRIGGER IF NOT EXISTS chunks_after_delete
-    AFTER DELETE ON chunks
-    BEGIN
-        INSERT INTO chunks_fts(chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
-    END;
-    """)
+    # Migrations run before the triggers are created, so any trigger dropped by a
+    # table rebuild is recreated below.
+    _apply_migrations(conn)
 
-    cursor.execute("""
-    CREATE TRIGGER IF NOT EXISTS chunks_after_update
-    AFTER UPDATE ON chunks
-    BEGIN
-        INSERT INTO chunks_fts(chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
-        INSERT INTO chunks_fts(rowid, content) VALUES (new.id, new.content);
-    END;
-    """)
+    # Create the triggers that keep the FTS table synchronized with the chunks table.
+    # They are missing on purpose while a 'scan --bulk' runs, and after one was
+    # interrupted; only repair_interrupted_bulk_ingest() restores them then, as the
+    # FTS table has to be rebuilt first.
+    if _missing_fts_triggers(conn) and not config.BULK_INGEST_MARKER_PATH.exists():
+        with transaction():
+            # Checked again with the write lock held, in case a bulk ingest started
+            if not config.BULK_INGEST_MARKER_PATH.exists():
+                for ddl in FTS_TRIGGERS.values():
+                    conn.execute(ddl)
+    _initialized = True
 
-    conn.commit()
-    conn.close()
+def _missing_fts_triggers(conn: sqlite3.Connection) -> bool:
+    """Returns True if any of the FTS_TRIGGERS does not exist."""
+    placeholders = ", ".join("?" * len(FTS_TRIGGERS))
+    count = conn.execute(
+        f"SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN ({placeholders})",
+        list(FTS_TRIGGERS),
+    ).fetchone()[0]
+    return count < len(FTS_TRIGGERS)
+
+def _lock_bulk_ingest_marker() -> Optional[BinaryIO]:
+    """
+    Opens the bulk ingest marker, creating it if needed, and takes an exclusive lock
+    on it. The OS releases the lock when the process exits, however it exits.
+
+    Returns:
+        The open marker file, or None if another process holds the lock.
+    """
+    marker = open(config.BULK_INGEST_MARKER_PATH, "a+b")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            marker.seek(0)
+            msvcrt.locking(marker.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            # A record lock rather than flock(): it belongs to this process only, so
+            # scan workers forked while it is held don't keep it alive after a crash.
+            fcntl.lockf(marker.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # The marker may have been deleted and recreated between opening and
+            # locking it, in which case the lock is on a file nobody else sees.
+            if os.fstat(marker.fileno()).st_ino != os.stat(config.BULK_INGEST_MARKER_PATH).st_ino:
+                raise BlockingIOError
+    except OSError:
+        marker.close()
+        return None
+    return marker
+
+def _remove_bulk_ingest_marker(marker: BinaryIO):
+    """Deletes a locked marker, releasing the lock only once it is gone."""
+    if os.name == "nt":
+        marker.close() # Windows can't delete an open file
+    try:
+        config.BULK_INGEST_MARKER_PATH.unlink()
+    except OSError:
+        pass
+    marker.close()
+
+def repair_interrupted_bulk_ingest() -> bool:
+    """
+    Finishes the work of a 'scan --bulk' that was interrupted: rebuilds the FTS
+    table and recreates the FTS_TRIGGERS. Does nothing while a bulk ingest is
+    still running. Only commands that write to the database should call this.
+
+    Returns:
+        True if an interrupted bulk ingest was repaired.
+    """
+    if not config.BULK_INGEST_MARKER_PATH.exists():
+        return False
+    marker = _lock_bulk_ingest_marker()
+    if marker is None:
+        return False
+    try:
+        with transaction() as conn:
+            conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+            for ddl in FTS_TRIGGERS.values():
+                conn.execute(ddl)
+    except BaseException:
+        marker.close()
+        raise
+    _remove_bulk_ingest_marker(marker)
+    return True
+
+@contextmanager
+def fts_triggers_disabled() -> Iterator[None]:
+    """
+    Drops the FTS_TRIGGERS for the duration of a bulk ingest, then rebuilds the
+    full-text index in a single pass and recreates them.
+    The triggers add several writes to every chunk inserted or deleted, which
+    dominates the cost of indexing many files at once. Keyword search is out of
+    date until the block exits. A locked marker file records that the triggers
+    are dropped on purpose, and is left behind if the process dies before the end.
+    """
+    config.ensure_app_dirs()
+    marker = _lock_bulk_ingest_marker()
+    if marker is None:
+        raise RuntimeError("Another 'scan --bulk' is already running.")
+    conn = get_db_connection()
+    try:
+        with transaction():
+            for name in FTS_TRIGGERS:
+                conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        yield
+    finally:
+        try:
+            with transaction():
+                conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+                for ddl in FTS_TRIGGERS.values():
+                    conn.execute(ddl)
+        except BaseException:
+            # Keep the marker, so the next write command repairs the FTS table
+            marker.close()
+            raise
+        _remove_bulk_ingest_marker(marker)
+
+def _apply_migrations(conn: sqlite3.Connection):
+    """
+    Applies any schema migrations that have not been run on this database yet.
+    They run in one transaction that takes the write lock first, so a crash can't
+    leave a migration applied without its version bump, and a second process
+    migrating at the same time waits and then finds nothing left to do.
+    """
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+        return
+    # Table rebuilds must not cascade deletes. This pragma has no effect inside a
+    # transaction, so it is switched around it.
+    conn.execute("PRAGMA foreign_keys=OFF")
+    try:
+        with transaction():
+            # Read again with the write lock held
+            current_version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for version, migration in enumerate(MIGRATIONS[current_version:], start=current_version + 1):
+                if callable(migration):
+                    migration(conn)
+                else:
+                    for statement in migration:
+                        conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {version}")
+    finally:
+        conn.execute("PRAGMA foreign_keys=ON")
 
 if __name__ == '__main__':
     print("Initializing database...")
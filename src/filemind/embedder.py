@@ -1,11 +1,31 @@
 from typing import List, Optional
+import os
+import threading
 import numpy as np
 import onnxruntime as ort
-from tokenizers import Tokenizer
-from . import config
+from tokenizers import Encoding, Tokenizer
+from . import config, hasher
+
+# Batches are padded up to a multiple of this many tokens. Only a handful of distinct
+# input shapes then reach the model, so ONNX Runtime can reuse its memory plans and
+# arena allocations between batches instead of planning for every new length.
+SEQUENCE_BUCKET_SIZE = 32
+
+# Upper bound on (batch size x padded sequence length) for a single model call.
+# Batches of short texts hold many of them, batches of long texts only a few,
+# so every call does a similar amount of work.
+MAX_BATCH_TOKENS = 8192
+
+# Execution providers to use instead of the CPU when onnxruntime was built with them
+# (the onnxruntime-gpu and onnxruntime-directml packages), in order of preference.
+GPU_PROVIDERS = ("CUDAExecutionProvider", "DmlExecutionProvider")
 
 class EmbeddingModel:
     _instance: Optional['EmbeddingModel'] = None
+    _instance_lock = threading.Lock()
+    # Threads ONNX Runtime runs each operator on, read when the model is loaded.
+    # None uses all cores; 'scan' leaves some of them to its worker processes.
+    num_threads: Optional[int] = None
 
     def __init__(self):
         """
@@ -21,67 +41,156 @@ class EmbeddingModel:
                 f"Checked paths: {model_path}, {tokenizer_path}"
             )
         
-        self.session = ort.InferenceSession(str(model_path))
+        available_providers = ort.get_available_providers()
+        gpu_provider = next((p for p in GPU_PROVIDERS if p in available_providers), None)
+
+        # Prefer the INT8 model produced by 'filemind init' when it exists. Its integer
+        # kernels only exist for the CPU, so a GPU runs the original model instead.
+        if gpu_provider is None and config.QUANTIZED_MODEL_PATH.exists():
+            model_path = config.QUANTIZED_MODEL_PATH
+
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # The threads go to parallelizing each operator. The encoder is a straight chain
+        # of layers, so running independent branches in parallel would gain nothing.
+        session_options.intra_op_num_threads = self.num_threads or os.cpu_count() or 1
+        session_options.inter_op_num_threads = 1
+        session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        session_options.enable_cpu_mem_arena = True
+        # DirectML does not support memory patterns
+        session_options.enable_mem_pattern = gpu_provider != "DmlExecutionProvider"
+        # Grow the arena by exactly what is requested instead of doubling it. The CPU
+        # also runs any operator that the GPU provider doesn't support.
+        providers = [("CPUExecutionProvider", {"arena_extend_strategy": "kSameAsRequested"})]
+        if gpu_provider is not None:
+            providers.insert(0, gpu_provider)
+        self.session = ort.InferenceSession(
+            str(model_path),
+            sess_options=session_options,
+            providers=providers,
+        )
+        # Identifies the weights behind the embeddings, so cached embeddings are only
+        # reused with the model that produced them
+        self.model_id = hasher.generate_file_hash(model_path)
+        # The hidden states are the model's only output we use; see _embed_batch
+        self.output_name = self.session.get_outputs()[0].name
         self.tokenizer = Tokenizer.from_file(str(tokenizer_path))
         
         # Set a max length for the tokenizer
         self.tokenizer.enable_truncation(max_length=512)
-        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]", length=512)
+        # Texts are tokenized once up front, so padding is applied per batch in _embed_batch
+        self.tokenizer.no_padding()
 
     @classmethod
     def get_instance(cls) -> 'EmbeddingModel':
-        """Gets the singleton instance of the EmbeddingModel."""
+        """
+        Gets the singleton instance of the EmbeddingModel.
+        Loading the model is expensive, so concurrent first calls are serialized
+        and only one of them creates the session.
+        """
         if cls._instance is None:
-            cls._instance = cls()
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
         return cls._instance
 
-    def _l2_normalize(self, v: np.ndarray) -> np.ndarray:
-        """Performs L2 normalization on a vector."""
-        norm = np.linalg.norm(v, axis=1, keepdims=True)
-        return v / (norm + 1e-12) # Add epsilon for stability
+    def _l2_normalize(self, v: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Performs L2 normalization on a vector, optionally writing the result to `out`."""
+        # einsum computes the squared norms in a single pass without a temporary v*v
+        # array, and multiplying by the reciprocal is cheaper than dividing every element.
+        inv_norm = 1.0 / np.sqrt(np.einsum('ij,ij->i', v, v) + 1e-24) # Add epsilon for stability
+        return np.multiply(v, inv_norm[:, None], out=out)
 
-    def generate_embeddings(self, texts: List[str]) -> np.ndarray:
+    @staticmethod
+    def _padded_length(num_tokens: int) -> int:
+        """Rounds a sequence length up to its bucket."""
+        return -(-num_tokens // SEQUENCE_BUCKET_SIZE) * SEQUENCE_BUCKET_SIZE
+
+    def _embed_batch(self, encoded: List[Encoding]) -> np.ndarray:
+        """Runs a single batch of tokenized texts through the model."""
+        # 1. Pad the batch only up to the bucket of its longest sequence instead of always to 512
+        seq_len = self._padded_length(max(len(e.ids) for e in encoded))
+
+        # Zeros are the [PAD] token ID
+        input_ids = np.zeros((len(encoded), seq_len), dtype=np.int64)
+        lengths = np.empty(len(encoded), dtype=np.int64)
+        for row, e in enumerate(encoded):
+            ids = e.ids
+            lengths[row] = len(ids)
+            input_ids[row, :len(ids)] = ids
+        # Unpadded encodings attend to every token, so the mask is just each row's length
+        attention_mask = (np.arange(seq_len) < lengths[:, None]).astype(np.int64)
+        # The BGE model from Qdrant also expects token_type_ids, which are all zero
+        # for single-sequence inputs
+        token_type_ids = np.zeros((len(encoded), seq_len), dtype=np.int64)
+
+        # 2. Run inference with ONNX Runtime
+        onnx_input = {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'token_type_ids': token_type_ids
+        }
+
+        last_hidden_state = self.session.run([self.output_name], onnx_input)[0]
+        
+        # 3. Extract the [CLS] token embedding (first token)
+        return last_hidden_state[:, 0, :]
+
+    def generate_embeddings(
+        self,
+        texts: List[str],
+        max_batch_tokens: int = MAX_BATCH_TOKENS,
+        out: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
         """
         Generates L2-normalized embeddings for a list of texts.
         
         Args:
             texts: A list of strings to embed.
+            max_batch_tokens: The maximum number of (padded) tokens to run through
+                the model at once.
+            out: An optional float32 array of shape (num_texts, embedding_dim) to
+                write the embeddings into, so callers embedding many batches can
+                reuse one buffer instead of allocating a new array each time.
             
         Returns:
             A numpy array of shape (num_texts, embedding_dim) containing
-            the L2-normalized embeddings.
+            the L2-normalized embeddings, in the same order as `texts`.
+            This is `out` when it was given.
         """
-        # 1. Tokenize the input texts
-        encoded = [self.tokenizer.encode(text) for text in texts]
-        
-        input_ids = np.array([e.ids for e in encoded])
-        attention_mask = np.array([e.attention_mask for e in encoded])
-        # The BGE model from Qdrant also expects token_type_ids
-        token_type_ids = np.array([e.type_ids for e in encoded])
-
-        # 2. Run inference with ONNX Runtime
-        onnx_input = {
-            'input_ids': input_ids.astype(np.int64),
-            'attention_mask': attention_mask.astype(np.int64),
-            'token_type_ids': token_type_ids.astype(np.int64)
-        }
+        # Sort by token count so each batch holds texts of similar length and wastes
+        # as little compute as possible on padding tokens. Character counts are only
+        # a rough proxy: the number of tokens per character varies a lot by content.
+        encoded = self.tokenizer.encode_batch(texts)
+        order = np.argsort([len(e.ids) for e in encoded], kind="stable")
 
-        model_output = self.session.run(None, onnx_input)
+        batches = []
+        batch: List[Encoding] = []
+        for i in order:
+            # Sorted ascending, so the current text is the longest in the batch
+            padded_len = self._padded_length(len(encoded[i].ids))
+            if batch and (len(batch) + 1) * padded_len > max_batch_tokens:
+                batches.append(self._embed_batch(batch))
+                batch = []
+            batch.append(encoded[i])
+        if batch:
+            batches.append(self._embed_batch(batch))
+        sorted_embeddings = np.concatenate(batches)
 
-        last_hidden_state = model_output[0]
-        
-        # 3. Extract the [CLS] token embedding (first token)
-        cls_embeddings = last_hidden_state[:, 0, :]
-        
-        # 4. Normalize the embeddings
-        normalized_embeddings = self._l2_normalize(cls_embeddings)
+        # Scatter the results back into the caller's order
+        if out is None:
+            out = np.empty(sorted_embeddings.shape, dtype=np.float32)
+        elif out.shape != sorted_embeddings.shape or out.dtype != np.float32:
+            raise ValueError(f"out must be a float32 array of shape {sorted_embeddings.shape}")
+        out[order] = sorted_embeddings
         
-        return normalized_embeddings.astype(np.float32)
+        # 4. Normalize the embeddings in place
+        return self._l2_normalize(out, out=out)
 
 # Convenience function to be used by other modules
-def generate_embeddings(texts: List[str]) -> np.ndarray:
+def generate_embeddings(texts: List[str], out: Optional[np.ndarray] = None) -> np.ndarray:
     """
     A wrapper function to get the model instance and generate embeddings.
     """
     model = EmbeddingModel.get_instance()
-    return model.generate_embeddings(texts)
+    return model.generate_embeddings(texts, out=out)
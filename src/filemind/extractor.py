@@ -1,10 +1,28 @@
 from pathlib import Path
-from typing import List, Iterator
-import pdfplumber
-import docx
+import mmap
+import os
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, Iterator
+from tokenizers import Tokenizer
+from . import config
 
 def _extract_text_from_pdf(file_path: Path) -> str:
-    """Extracts text from a PDF file."""
+    """
+    Extracts text from a PDF file.
+    Uses PyMuPDF when it is installed (the optional 'pdf' extra), whose C parser is
+    many times faster than pdfplumber's pure-Python one, and pdfplumber otherwise.
+    """
+    try:
+        import pymupdf # LAZY IMPORT: optional, only needed once a PDF is found
+    except ImportError:
+        return _extract_text_from_pdf_with_pdfplumber(file_path)
+    with pymupdf.open(file_path) as pdf:
+        return "\n".join(page_text for page_text in (page.get_text() for page in pdf) if page_text)
+
+def _extract_text_from_pdf_with_pdfplumber(file_path: Path) -> str:
+    """Extracts text from a PDF file using pdfplumber."""
+    import pdfplumber # LAZY IMPORT: only needed once a PDF is found
     text = []
     with pdfplumber.open(file_path) as pdf:
         for page in pdf.pages:
@@ -15,19 +33,38 @@ def _extract_text_from_pdf(file_path: Path) -> str:
 
 def _extract_text_from_docx(file_path: Path) -> str:
     """Extracts text from a DOCX file."""
+    import docx # LAZY IMPORT: only needed once a DOCX is found
     doc = docx.Document(file_path)
     return "\n".join([para.text for para in doc.paragraphs])
 
 def _extract_text_from_txt(file_path: Path) -> str:
-    """Extracts text from a TXT file."""
-    try:
-        return file_path.read_text(encoding='utf-8')
-    except UnicodeDecodeError:
-        # Fallback for other common encodings if utf-8 fails
-        try:
-            return file_path.read_text(encoding='latin-1')
-        except Exception:
-            return "" # Return empty string if all fails
+    """
+    Extracts text from a TXT file.
+    The file is memory-mapped and decoded straight from the page cache, which avoids
+    reading it into an intermediate bytes object first.
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return "" # Empty files can't be memory-mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, 'madvise'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            try:
+                return str(mm, encoding='utf-8')
+            except UnicodeDecodeError:
+                # Fallback for other common encodings if utf-8 fails
+                try:
+                    return str(mm, encoding='latin-1')
+                except Exception:
+                    return "" # Return empty string if all fails
+
+# Text extractor for each supported file extension. Keep in sync with
+# cli.SUPPORTED_EXTENSIONS, which decides what 'scan' passes in here.
+EXTRACTORS: Dict[str, Callable[[Path], str]] = {
+    ".pdf": _extract_text_from_pdf,
+    ".docx": _extract_text_from_docx,
+    ".txt": _extract_text_from_txt,
+}
 
 def extract_text(file_path: Path) -> str:
     """
@@ -35,48 +72,62 @@ def extract_text(file_path: Path) -> str:
     
     Returns an empty string if the file type is not supported or an error occurs.
     """
-    extension = file_path.suffix.lower()
-    if extension == ".pdf":
-        return _extract_text_from_pdf(file_path)
-    elif extension == ".docx":
-        return _extract_text_from_docx(file_path)
-    elif extension == ".txt":
-        return _extract_text_from_txt(file_path)
-    else:
+    extractor = EXTRACTORS.get(file_path.suffix.lower())
+    if extractor is None:
         # Silently ignore unsupported files
         return ""
+    return extractor(file_path)
+
+# Any run of whitespace, collapsed to a single space before chunking
+_WHITESPACE = re.compile(r"\s+")
+
+@lru_cache(maxsize=1)
+def _get_tokenizer() -> Tokenizer:
+    """Loads the embedding model's tokenizer once per process, for measuring chunks."""
+    tokenizer_path = config.MODEL_DIR / "tokenizer.json"
+    if not tokenizer_path.exists():
+        raise FileNotFoundError(
+            f"Model or tokenizer not found. Please run 'filemind init'. "
+            f"Checked path: {tokenizer_path}"
+        )
+    tokenizer = Tokenizer.from_file(str(tokenizer_path))
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
 
 def chunk_text(
     text: str,
-    chunk_size: int = 1000,
-    chunk_overlap: int = 200,
+    chunk_size: int = 256,
+    chunk_overlap: int = 64,
 ) -> Iterator[str]:
     """
-    Splits a text into overlapping chunks.
+    Splits a text into overlapping chunks of model tokens.
+    Whitespace is normalized once for the whole text, which is then tokenized in a
+    single call. Each chunk is cut from it using the token offsets, so chunks line
+    up with what the embedding model sees and are never truncated by it.
     
     Args:
         text: The input text.
-        chunk_size: The desired size of each chunk (in characters).
-        chunk_overlap: The number of characters to overlap between chunks.
+        chunk_size: The desired size of each chunk (in tokens).
+        chunk_overlap: The number of tokens to overlap between chunks.
         
     Returns:
         An iterator of text chunks.
     """
+    # Tokens never include whitespace, so this doesn't change the tokenization,
+    # and chunks cut at token boundaries need no further cleanup.
+    text = _WHITESPACE.sub(" ", text).strip()
     if not text:
         return
-        
+
+    offsets = _get_tokenizer().encode(text, add_special_tokens=False).offsets
+    num_tokens = len(offsets)
     start = 0
-    text_len = len(text)
-    while start < text_len:
-        end = start + chunk_size
-        chunk = text[start:end]
-        
-        # As per the plan, normalize whitespace and drop empty chunks
-        chunk = " ".join(chunk.split())
-        if chunk:
-            yield chunk
+    while start < num_tokens:
+        end = min(start + chunk_size, num_tokens)
+        yield text[offsets[start][0]:offsets[end - 1][1]]
             
         # Move the start position forward, considering the overlap
         start += chunk_size - chunk_overlap
-        if start >= text_len:
+        if end >= num_tokens:
             break
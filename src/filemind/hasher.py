@@ -1,23 +1,95 @@
-import hashlib
 from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
 
-def generate_file_hash(file_path: Path, chunk_size: int = 65536) -> str:
+import blake3
+
+# Stored alongside each hash so digests from different algorithms are never compared.
+HASH_ALGORITHM = "blake3"
+
+# Files at least this large are memory-mapped instead of read into memory.
+MMAP_THRESHOLD = 1 << 20  # 1 MiB
+# Files at least this large are hashed using multiple threads.
+MULTITHREAD_THRESHOLD = 16 << 20  # 16 MiB
+
+# Smaller files are read into a per-thread buffer that is reused across calls,
+# so hashing many small files doesn't allocate a new bytes object for each one.
+_buffers = threading.local()
+
+def _get_read_buffer() -> memoryview:
+    """Returns this thread's reusable read buffer, large enough for any non-mmapped file."""
+    buffer = getattr(_buffers, "buffer", None)
+    if buffer is None:
+        buffer = _buffers.buffer = memoryview(bytearray(MMAP_THRESHOLD))
+    return buffer
+
+def _hash_with_buffer(file_hasher, file_path: Path):
+    """Feeds a file to the hasher through the reusable read buffer."""
+    buffer = _get_read_buffer()
+    with open(file_path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        # Loop, since the file may have grown since it was stat()ed
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            file_hasher.update(buffer[:n])
+
+def generate_file_hash(file_path: Path, file_size: Optional[int] = None) -> str:
     """
-    Generates the SHA256 hash of a file.
+    Generates the BLAKE3 hash of a file.
+
+    Small files are read through a reusable buffer; larger files are memory-mapped,
+    and very large files are additionally hashed across all available cores.
 
     Args:
         file_path: The path to the file.
-        chunk_size: The size of chunks to read the file in (for large files).
+        file_size: The size of the file, if already known from a previous stat().
 
     Returns:
-        The SHA256 hash of the file as a hexadecimal string.
+        The BLAKE3 hash of the file as a hexadecimal string.
     """
-    sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        # Read and update hash string in chunks
-        for byte_block in iter(lambda: f.read(chunk_size), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
+    size = file_path.stat().st_size if file_size is None else file_size
+    if size >= MULTITHREAD_THRESHOLD:
+        file_hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+    else:
+        file_hasher = blake3.blake3()
+
+    if size >= MMAP_THRESHOLD:
+        file_hasher.update_mmap(file_path)
+    else:
+        _hash_with_buffer(file_hasher, file_path)
+    return file_hasher.hexdigest()
+
+def hash_files(files: Iterable[Tuple[Path, int]], workers: Optional[int] = None) -> Iterator[Optional[str]]:
+    """
+    Generates the hashes of many files concurrently.
+    BLAKE3 releases the GIL while hashing, so threads are enough to use every core.
+
+    Args:
+        files: (path, size) pairs, with sizes as known from a previous stat().
+        workers: The number of threads to use. Defaults to the number of CPUs.
+
+    Returns:
+        An iterator of hashes in the same order as `files`, with None for any
+        file that could not be read.
+    """
+    def hash_one(file_info: Tuple[Path, int]) -> Optional[str]:
+        file_path, file_size = file_info
+        try:
+            return generate_file_hash(file_path, file_size)
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        yield from executor.map(hash_one, files)
+
+def generate_content_hash(text: str) -> bytes:
+    """Generates the raw BLAKE3 digest of a piece of text, e.g. a chunk."""
+    return blake3.blake3(text.encode("utf-8")).digest()
 
 if __name__ == "__main__":
     # Example usage: create a dummy file and hash it
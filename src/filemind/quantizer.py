@@ -0,0 +1,55 @@
+from pathlib import Path
+import numpy as np
+
+def _convert_float16_to_float32(model):
+    """
+    Converts an FP16 ONNX model to FP32 in place.
+    The dynamic quantizer only understands FP32 weights, and the bundled model is FP16.
+    """
+    import onnx
+    from onnx import numpy_helper, TensorProto
+
+    graph = model.graph
+    for initializer in graph.initializer:
+        if initializer.data_type == TensorProto.FLOAT16:
+            weights = numpy_helper.to_array(initializer).astype(np.float32)
+            initializer.CopyFrom(numpy_helper.from_array(weights, initializer.name))
+
+    for node in graph.node:
+        for attribute in node.attribute:
+            if node.op_type == "Cast" and attribute.name == "to" and attribute.i == TensorProto.FLOAT16:
+                attribute.i = TensorProto.FLOAT
+            elif attribute.type == onnx.AttributeProto.TENSOR and attribute.t.data_type == TensorProto.FLOAT16:
+                value = numpy_helper.to_array(attribute.t).astype(np.float32)
+                attribute.t.CopyFrom(numpy_helper.from_array(value, attribute.t.name))
+
+    for value_info in list(graph.value_info) + list(graph.input) + list(graph.output):
+        if value_info.type.tensor_type.elem_type == TensorProto.FLOAT16:
+            value_info.type.tensor_type.elem_type = TensorProto.FLOAT
+    return model
+
+def quantize_model(model_path: Path, output_path: Path):
+    """
+    Writes a dynamically quantized INT8 copy of an ONNX model.
+
+    MatMul and Attention weights are stored as per-channel INT8, which lets
+    ONNX Runtime use integer dot-product instructions (e.g. AVX512-VNNI) on CPU.
+
+    Raises:
+        ImportError: If the optional 'onnx' package is not installed.
+    """
+    import onnx
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    float32_path = output_path.with_suffix(".fp32.tmp")
+    try:
+        model = _convert_float16_to_float32(onnx.load(str(model_path)))
+        onnx.save(model, str(float32_path))
+        quantize_dynamic(
+            str(float32_path),
+            str(output_path),
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+        )
+    finally:
+        float32_path.unlink(missing_ok=True)
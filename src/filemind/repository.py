@@ -1,31 +1,31 @@
+import itertools
 import sqlite3
 import time
 from pathlib import Path
-from typing import Optional, Tuple, List
+from typing import Dict, Iterator, Optional, Tuple, List
 
-from . import database
+from . import database, hasher
 
-def add_file(file_path: Path, file_hash: str, file_size: int, mtime: int) -> int:
+def add_file(file_path: Path, file_hash: Optional[str], file_size: int, mtime: int, hash_algorithm: str = hasher.HASH_ALGORITHM) -> int:
     """
     Adds a file record to the database.
+    A file_hash of None records the file as not hashed yet (see 'hash-missing').
 
     Returns:
         The ID of the newly inserted file.
     """
-    conn = database.get_db_connection()
-    cursor = conn.cursor()
     indexed_at = int(time.time())
-    cursor.execute(
-        """
-        INSERT INTO files (file_path, file_hash, file_size, last_modified_time, indexed_at)
-        VALUES (?, ?, ?, ?, ?)
-        """,
-        (str(file_path), file_hash, file_size, mtime, indexed_at),
-    )
-    conn.commit()
-    last_id = cursor.lastrowid
-    conn.close()
-    return last_id
+    if file_hash is None:
+        hash_algorithm = None
+    with database.transaction() as conn:
+        cursor = conn.execute(
+            """
+            INSERT INTO files (file_path, file_hash, hash_algorithm, file_size, last_modified_time, indexed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (str(file_path), file_hash, hash_algorithm, file_size, mtime, indexed_at),
+        )
+    return cursor.lastrowid
 
 def get_file_by_path(file_path: Path) -> Optional[Tuple[int, int, int]]:
     """
@@ -41,167 +41,311 @@ def get_file_by_path(file_path: Path) -> Optional[Tuple[int, int, int]]:
         (str(file_path),),
     )
     result = cursor.fetchone()
-    conn.close()
     return result
 
-def get_file_path_by_id(file_id: int) -> Optional[str]:
-    """Retrieves a file's path given its ID."""
+def get_all_file_stats() -> Dict[str, Tuple[int, int, Optional[str]]]:
+    """
+    Loads the size, last modified time and hash of every indexed file in one query.
+    Hashes made with an older algorithm are returned as None.
+
+    Returns:
+        A dict mapping each file path to (file_size, last_modified_time, file_hash).
+    """
     conn = database.get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT file_path FROM files WHERE id = ?", (file_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
+    cursor = conn.execute(
+        """
+        SELECT file_path, file_size, last_modified_time,
+               CASE WHEN hash_algorithm = ? THEN file_hash END
+        FROM files
+        """,
+        (hasher.HASH_ALGORITHM,),
+    )
+    return {file_path: (file_size, mtime, file_hash) for file_path, file_size, mtime, file_hash in cursor}
 
-def delete_file_and_chunks(file_id: int):
+def update_file_stat(file_path: Path, file_size: int, mtime: int, file_hash: Optional[str], hash_algorithm: str = hasher.HASH_ALGORITHM):
     """
-    Deletes a file record and all its associated chunks from the database.
-    Because of ON DELETE CASCADE, deleting from 'files' will delete from 'chunks'.
+    Updates a file's size, last modified time and hash, keeping its chunks.
+    A file_hash of None clears the stored hash, which may no longer match the file's
+    bytes even if its text is unchanged, so 'hash-missing' hashes it again.
     """
-    conn = database.get_db_connection()
-    conn.execute("PRAGMA foreign_keys = ON") # Ensure FKs are enabled
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM files WHERE id = ?", (file_id,))
-    conn.commit()
-    conn.close()
+    if file_hash is None:
+        hash_algorithm = None
+    with database.transaction() as conn:
+        conn.execute(
+            """
+            UPDATE files SET file_size = ?, last_modified_time = ?, file_hash = ?, hash_algorithm = ?
+            WHERE file_path = ?
+            """,
+            (file_size, mtime, file_hash, hash_algorithm, str(file_path)),
+        )
 
-def add_chunk(file_id: int, chunk_index: int, content: str) -> int:
+def get_chunk_contents(file_path: Path) -> List[str]:
     """
-    Adds a text chunk to the database. The triggers will automatically update the FTS table.
+    Retrieves the text of a file's chunks, in order.
 
     Returns:
-        The ID of the newly inserted chunk.
+        The chunk contents, or an empty list if the file is not indexed.
     """
     conn = database.get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO chunks (file_id, chunk_index, content) VALUES (?, ?, ?)",
-        (file_id, chunk_index, content),
+    cursor = conn.execute(
+        """
+        SELECT c.content
+        FROM chunks c JOIN files f ON f.id = c.file_id
+        WHERE f.file_path = ?
+        ORDER BY c.chunk_index
+        """,
+        (str(file_path),),
     )
-    conn.commit()
-    last_id = cursor.lastrowid
-    conn.close()
-    return last_id
+    return [content for content, in cursor]
 
-def find_duplicate_hashes() -> List[Tuple[str, int]]:
+def delete_file_and_chunks(file_id: int):
     """
+    Deletes a file record and all its associated chunks from the database.
+    Because of ON DELETE CASCADE, deleting from 'files' will delete from 'chunks'.
+    """
+    with database.transaction() as conn:
+        conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
 
-    Finds file hashes that appear more than once in the database.
+def add_chunks_bulk(file_id: int, chunks: List[str]) -> List[int]:
+    """
+    Adds all text chunks of a file to the database in a single transaction.
+    The triggers will automatically update the FTS table.
 
     Returns:
-        A list of tuples, where each tuple contains (file_hash, count).
+        The IDs of the inserted chunks, in order.
+    """
+    with database.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO chunks (file_id, chunk_index, content) VALUES (?, ?, ?)",
+            [(file_id, i, content) for i, content in enumerate(chunks)],
+        )
+        # cursor.lastrowid is not updated by executemany, so ask SQLite directly.
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    # IDs are allocated consecutively within a single transaction
+    return list(range(last_id - len(chunks) + 1, last_id + 1))
+
+def get_cached_embeddings(model_id: str, content_hashes: List[bytes], batch_size: int = 500) -> Dict[bytes, bytes]:
+    """
+    Looks up embeddings cached for the given model by chunk content hash.
+
+    Returns:
+        A dict mapping each content hash found in the cache to its raw embedding bytes.
     """
     conn = database.get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT file_hash, COUNT(*)
-        FROM files
-        GROUP BY file_hash
-        HAVING COUNT(*) > 1
-        """
-    )
-    results = cursor.fetchall()
-    conn.close()
+    results = {}
+    # Stay well below SQLite's limit on the number of bound parameters
+    for start in range(0, len(content_hashes), batch_size):
+        batch = content_hashes[start:start + batch_size]
+        placeholders = ",".join("?" for _ in batch)
+        cursor = conn.execute(
+            f"SELECT content_hash, embedding FROM chunk_cache WHERE model_id = ? AND content_hash IN ({placeholders})",
+            [model_id, *batch],
+        )
+        results.update(cursor.fetchall())
     return results
 
-def get_files_by_hash(file_hash: str) -> List[Tuple[str, int, int]]:
+def add_cached_embeddings(model_id: str, entries: List[Tuple[bytes, bytes]]):
+    """Stores (content_hash, embedding bytes) pairs made by the given model in the embedding cache."""
+    with database.transaction() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO chunk_cache (model_id, content_hash, embedding) VALUES (?, ?, ?)",
+            [(model_id, content_hash, embedding) for content_hash, embedding in entries],
+        )
+
+def prune_embedding_cache(model_id: str) -> int:
     """
-    Retrieves all files (path, size, mtime) for a given file hash.
+    Removes cached embeddings made by any other model, or whose text no longer
+    belongs to any chunk. Nothing else evicts rows from the cache.
 
     Returns:
-        A list of tuples, where each tuple is (file_path, file_size, last_modified_time).
+        The number of cached embeddings removed.
     """
+    with database.transaction() as conn:
+        # Lets SQLite hash every chunk's text itself, without a round trip per chunk
+        conn.create_function("content_hash", 1, hasher.generate_content_hash, deterministic=True)
+        cursor = conn.execute(
+            """
+            DELETE FROM chunk_cache
+            WHERE model_id != ? OR content_hash NOT IN (SELECT content_hash(content) FROM chunks)
+            """,
+            (model_id,),
+        )
+    return cursor.rowcount
+
+def get_files_missing_hash(only_shared_sizes: bool = False) -> List[Tuple[int, str, int]]:
+    """
+    Retrieves files that have no hash yet, or whose hash was made by an older algorithm.
+
+    Args:
+        only_shared_sizes: Only return files whose size is shared with another file,
+            i.e. the ones that could have a duplicate.
+
+    Returns:
+        A list of tuples, where each tuple is (id, file_path, file_size).
+    """
+    query = "SELECT id, file_path, file_size FROM files WHERE (file_hash IS NULL OR hash_algorithm != ?)"
+    if only_shared_sizes:
+        query += " AND file_size IN (SELECT file_size FROM files GROUP BY file_size HAVING COUNT(*) > 1)"
     conn = database.get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT file_path, file_size, last_modified_time FROM files WHERE file_hash = ?",
-        (file_hash,),
+    cursor = conn.execute(query, (hasher.HASH_ALGORITHM,))
+    return cursor.fetchall()
+
+def update_file_hashes(updates: List[Tuple[str, int]], hash_algorithm: str = hasher.HASH_ALGORITHM):
+    """Stores new hashes, given as (file_hash, file_id) pairs, in a single transaction."""
+    with database.transaction() as conn:
+        conn.executemany(
+            "UPDATE files SET file_hash = ?, hash_algorithm = ? WHERE id = ?",
+            [(file_hash, hash_algorithm, file_id) for file_hash, file_id in updates],
+        )
+
+def iter_duplicate_groups() -> Iterator[Tuple[str, List[Tuple[str, str, int, int]]]]:
+    """
+    Finds all groups of files sharing the same hash, in a single query.
+    Only files whose size is shared with another file are considered.
+
+    Yields:
+        Tuples of (file_hash, rows), where each row is (file_hash, file_path, file_size, last_modified_time).
+    """
+    conn = database.get_db_connection()
+    cursor = conn.execute(
+        """
+        WITH shared_sizes AS (
+            SELECT file_size
+            FROM files
+            GROUP BY file_size
+            HAVING COUNT(*) > 1
+        ),
+        duplicates AS (
+            SELECT file_hash
+            FROM files
+            WHERE file_hash IS NOT NULL AND file_size IN shared_sizes
+            GROUP BY file_hash
+            HAVING COUNT(*) > 1
+        )
+        SELECT f.file_hash, f.file_path, f.file_size, f.last_modified_time
+        FROM files f
+        JOIN duplicates USING (file_hash)
+        ORDER BY f.file_hash, f.file_path
+        """
     )
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    for file_hash, rows in itertools.groupby(cursor, key=lambda row: row[0]):
+        yield file_hash, list(rows)
+
+def _to_fts_query(query: str) -> str:
+    """
+    Turns free text into an FTS5 query matching all of its words.
+    Each word is quoted, so characters like '-', '*' or ':' are searched for instead
+    of being parsed as FTS5 syntax.
+    """
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
 
 def search_chunks_fts(query: str, limit: int = 20) -> List[int]:
     """
-    Performs a full-text search on the chunks_fts table.
+    Performs a full-text search on the chunks_fts table, best BM25 matches first.
 
     Returns:
         A list of matching chunk IDs.
     """
+    fts_query = _to_fts_query(query)
+    if not fts_query:
+        return []
     conn = database.get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
         "SELECT rowid FROM chunks_fts WHERE content MATCH ? ORDER BY rank LIMIT ?",
-        (query, limit),
+        (fts_query, limit),
     )
     results = [row[0] for row in cursor.fetchall()]
-    conn.close()
     return results
 
-def get_chunk_details_by_ids(chunk_ids: List[int]) -> List[Tuple[int, int, str]]:
-    """
-    Retrieves chunk details (id, file_id, content) for a list of chunk IDs.
-    """
-    if not chunk_ids:
-        return []
+def count_chunks(after_id: int = 0) -> int:
+    """Returns the number of chunks in the database, or of those with an ID above after_id."""
     conn = database.get_db_connection()
-    cursor = conn.cursor()
-    placeholders = ",".join("?" for _ in chunk_ids)
-    query = f"SELECT id, file_id, content FROM chunks WHERE id IN ({placeholders})"
-    cursor.execute(query, chunk_ids)
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    return conn.execute("SELECT COUNT(*) FROM chunks WHERE id > ?", (after_id,)).fetchone()[0]
 
-def get_all_chunks_ordered() -> List[Tuple[int, str]]:
+def iter_all_chunks_ordered(batch_size: int = 500, after_id: int = 0) -> Iterator[List[Tuple[int, str]]]:
     """
-    Retrieves the ID and content of all chunks, ordered by ID.
+    Streams the ID and content of all chunks, or of those with an ID above after_id,
+    ordered by ID, in batches.
+    Only one batch is held in memory at a time, so this scales to any number of chunks.
 
-    Returns:
-        A list of tuples, where each tuple is (id, content).
+    Yields:
+        Lists of up to batch_size tuples, where each tuple is (id, content).
     """
     conn = database.get_db_connection()
-    cursor = conn.cursor()
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    cursor = conn.execute("SELECT id, content FROM chunks WHERE id > ? ORDER BY id", (after_id,))
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        yield batch
 
-def calculate_hybrid_scores(semantic_results: Tuple, keyword_chunk_ids: List[int]) -> List[Tuple[int, dict]]:
+def calculate_hybrid_scores(semantic_results: Tuple, keyword_chunk_ids: List[int], top_k: Optional[int] = None) -> List[Tuple[int, dict]]:
     """
     Calculates hybrid scores for files based on semantic and keyword search results.
+
+    Each file scores its best semantic chunk match (never below 0), plus a 0.1 boost
+    for every keyword match among its chunks. Only files with a semantic match are ranked.
+    The hits are loaded into temporary tables, so grouping, boosting and the top-k
+    sort all happen inside SQLite.
+
+    Args:
+        semantic_results: The (distances, chunk_ids) returned by the vector store.
+        keyword_chunk_ids: Chunk IDs matched by the full-text search.
+        top_k: If given, only the best top_k files are returned.
+
+    Returns:
+        A list of (file_id, {"score", "is_keyword_match", "file_path"}) tuples, best first.
     """
-    from collections import defaultdict
-
-    distances, semantic_chunk_ids_flat = semantic_results
-    
-    file_scores = defaultdict(lambda: {"score": 0.0, "is_keyword_match": False})
-
-    # Process semantic search results
-    if semantic_chunk_ids_flat.size > 0:
-        # FAISS returns 0-based indices, our DB is 1-based.
-        # Ensure semantic_chunk_ids_flat is indeed a flat array before .tolist()
-        # If it's 2D (1,N), flatten it to 1D
-        if semantic_chunk_ids_flat.ndim > 1:
-            semantic_chunk_ids_flat = semantic_chunk_ids_flat.flatten()
-            
-        semantic_db_ids = (semantic_chunk_ids_flat + 1).tolist()
-        chunk_details = get_chunk_details_by_ids(semantic_db_ids)
-        
-        for i, (chunk_id, file_id, _) in enumerate(chunk_details):
-            score = float(distances[0][i]) # distances also need to be flattened or indexed correctly
-            if score > file_scores[file_id]["score"]:
-                file_scores[file_id]["score"] = score
-
-    # Process keyword search results and apply boost
-    if keyword_chunk_ids:
-        chunk_details = get_chunk_details_by_ids(keyword_chunk_ids)
-        for _, file_id, _ in chunk_details:
-            if file_id in file_scores:
-                file_scores[file_id]["is_keyword_match"] = True
-                file_scores[file_id]["score"] += 0.1 # Apply boost
-
-    # Sort files by final score
-    sorted_files = sorted(file_scores.items(), key=lambda item: item[1]["score"], reverse=True)
-    
-    return sorted_files
+    distances, semantic_chunk_ids = semantic_results
+    if semantic_chunk_ids.size == 0:
+        return []
+
+    conn = database.get_db_connection()
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS semantic_hits (chunk_id INTEGER PRIMARY KEY, score REAL NOT NULL)")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS keyword_hits (chunk_id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.semantic_hits")
+    conn.execute("DELETE FROM temp.keyword_hits")
+
+    # FAISS returns chunk IDs directly, with -1 for empty result slots. Chunks deleted
+    # since the last 'rebuild-index' are dropped by the join with 'chunks' below.
+    conn.executemany(
+        "INSERT OR IGNORE INTO temp.semantic_hits (chunk_id, score) VALUES (?, ?)",
+        [
+            (chunk_id, score)
+            for chunk_id, score in zip(semantic_chunk_ids.ravel().tolist(), distances.ravel().tolist())
+            if chunk_id != -1
+        ],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO temp.keyword_hits (chunk_id) VALUES (?)",
+        [(chunk_id,) for chunk_id in keyword_chunk_ids],
+    )
+
+    cursor = conn.execute(
+        """
+        WITH semantic AS (
+            SELECT c.file_id, MAX(0.0, MAX(h.score)) AS score
+            FROM temp.semantic_hits h
+            JOIN chunks c ON c.id = h.chunk_id
+            GROUP BY c.file_id
+        ),
+        keyword AS (
+            SELECT c.file_id, COUNT(*) AS hits
+            FROM temp.keyword_hits h
+            JOIN chunks c ON c.id = h.chunk_id
+            GROUP BY c.file_id
+        )
+        SELECT s.file_id, s.score + 0.1 * COALESCE(k.hits, 0) AS score, k.hits IS NOT NULL, f.file_path
+        FROM semantic s
+        JOIN files f ON f.id = s.file_id
+        LEFT JOIN keyword k USING (file_id)
+        ORDER BY score DESC
+        LIMIT ?
+        """,
+        (top_k if top_k is not None else -1,),
+    )
+    return [
+        (file_id, {"score": score, "is_keyword_match": bool(is_keyword_match), "file_path": file_path})
+        for file_id, score, is_keyword_match, file_path in cursor
+    ]
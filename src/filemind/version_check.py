@@ -1,7 +1,6 @@
 import time
 import json
 from typing import Optional, Tuple
-import importlib.metadata
 
 import requests
 from packaging.version import parse as parse_version
@@ -12,6 +11,14 @@ CACHE_FILE = config.APP_DIR / "version_cache.json"
 CACHE_EXPIRY_SECONDS = 24 * 60 * 60  # 24 hours
 VERSION_URL = "https://karthikeya-akhandam.github.io/filemind/version.txt"
 
+def _read_cache() -> dict:
+    """Reads the cache file regardless of its age. Returns an empty dict if unreadable."""
+    try:
+        with open(CACHE_FILE, 'r') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, FileNotFoundError, OSError):
+        return {}
+
 def get_cached_version() -> Optional[str]:
     """Reads the latest version from the cache if it's not expired."""
     if not CACHE_FILE.exists():
@@ -20,26 +27,37 @@ def get_cached_version() -> Optional[str]:
     try:
         if time.time() - CACHE_FILE.stat().st_mtime > CACHE_EXPIRY_SECONDS:
             return None
-        with open(CACHE_FILE, 'r') as f:
-            return json.load(f).get('latest_version')
-    except (json.JSONDecodeError, FileNotFoundError, KeyError):
+    except FileNotFoundError:
         return None
+    return _read_cache().get('latest_version')
 
-def set_cached_version(latest_version: str):
-    """Writes the latest version to the cache file."""
+def set_cached_version(latest_version: str, etag: Optional[str] = None):
+    """Writes the latest version, and the ETag it was served with, to the cache file."""
     try:
         with open(CACHE_FILE, 'w') as f:
-            json.dump({'latest_version': latest_version}, f)
+            json.dump({'latest_version': latest_version, 'etag': etag}, f)
     except IOError:
         pass # Fail silently if cache can't be written
 
 def get_latest_version_from_url() -> Optional[str]:
-    """Fetches the latest version string from the hosted version.txt file."""
+    """
+    Fetches the latest version string from the hosted version.txt file.
+    The request is conditional on the ETag of the cached copy, so an unchanged
+    version is answered with an empty 304 response.
+    """
+    cache = _read_cache()
+    headers = {}
+    if cache.get('etag') and cache.get('latest_version'):
+        headers['If-None-Match'] = cache['etag']
     try:
-        response = requests.get(VERSION_URL, timeout=5)
+        response = requests.get(VERSION_URL, headers=headers, timeout=5)
+        if response.status_code == 304:
+            # Rewriting the cache restarts its expiry
+            set_cached_version(cache['latest_version'], cache['etag'])
+            return cache['latest_version']
         response.raise_for_status()
         latest_version_str = response.text.strip()
-        set_cached_version(latest_version_str)
+        set_cached_version(latest_version_str, response.headers.get('ETag'))
         return latest_version_str
     except requests.RequestException:
         return None
@@ -51,11 +69,10 @@ def check_for_new_version() -> Optional[Tuple[str, str]]:
     Returns:
         A tuple of (new_version, current_version) if an update is available, else None.
     """
-    try:
-        current_version_str = importlib.metadata.version("filemind")
-        current_version = parse_version(current_version_str)
-    except importlib.metadata.PackageNotFoundError:
+    current_version_str = config.get_installed_version()
+    if current_version_str is None:
         return None
+    current_version = parse_version(current_version_str)
 
     latest_version_str = get_cached_version()
     if not latest_version_str:
@@ -0,0 +1,18 @@
+import pytest
+
+from filemind import config, database
+
+@pytest.fixture(autouse=True)
+def app_dir(tmp_path, monkeypatch):
+    """Points every FileMind data path at a fresh temporary directory."""
+    app_dir = tmp_path / "FileMind"
+    monkeypatch.setattr(config, "APP_DIR", app_dir)
+    monkeypatch.setattr(config, "DB_PATH", app_dir / "filemind.db")
+    monkeypatch.setattr(config, "FAISS_INDEX_PATH", app_dir / "filemind.index")
+    monkeypatch.setattr(config, "FAISS_INDEX_META_PATH", app_dir / "filemind.index.json")
+    monkeypatch.setattr(config, "BULK_INGEST_MARKER_PATH", app_dir / "bulk_ingest.lock")
+    monkeypatch.setattr(config, "MODEL_DIR", app_dir / "models")
+    monkeypatch.setattr(config, "QUANTIZED_MODEL_PATH", app_dir / "models" / "model_quantized.onnx")
+    database.close_db_connection()
+    yield app_dir
+    database.close_db_connection()
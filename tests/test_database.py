@@ -0,0 +1,68 @@
+import sqlite3
+
+from filemind import config, database, repository
+
+# The schema of databases created before any migration existed
+BASELINE_SCHEMA = """
+CREATE TABLE files (
+    id INTEGER PRIMARY KEY,
+    file_path TEXT NOT NULL UNIQUE,
+    file_hash TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    last_modified_time INTEGER NOT NULL,
+    indexed_at INTEGER NOT NULL
+);
+CREATE TABLE chunks (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    FOREIGN KEY (file_id) REFERENCES files (id) ON DELETE CASCADE
+);
+CREATE VIRTUAL TABLE chunks_fts USING fts5(content, content='chunks', content_rowid='id');
+CREATE TRIGGER chunks_after_insert AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts(rowid, content) VALUES (new.id, new.content);
+END;
+INSERT INTO files VALUES (1, '/docs/report.txt', 'abc', 42, 1000, 2000);
+INSERT INTO chunks VALUES (7, 1, 0, 'Quarterly reports');
+INSERT INTO chunks VALUES (9, 1, 1, 'Revenue grew');
+"""
+
+def _create_baseline_database():
+    config.APP_DIR.mkdir(parents=True)
+    conn = sqlite3.connect(config.DB_PATH)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+
+def _assert_migrated():
+    conn = database.get_db_connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(database.MIGRATIONS)
+    assert conn.execute("SELECT file_path, file_hash, hash_algorithm FROM files").fetchall() == [
+        ("/docs/report.txt", "abc", "sha256")
+    ]
+    assert conn.execute("SELECT id, content FROM chunks ORDER BY id").fetchall() == [
+        (7, "Quarterly reports"),
+        (9, "Revenue grew"),
+    ]
+    # The porter tokenizer matches "report" to "reports"
+    assert repository.search_chunks_fts("report") == [7]
+
+def test_migrates_baseline_database():
+    _create_baseline_database()
+    database.initialize_database()
+    _assert_migrated()
+
+    # Files may now be stored without a hash, and their chunks are still cascaded
+    repository.add_file(config.APP_DIR / "new.txt", None, 1, 1)
+    repository.delete_file_and_chunks(1)
+    assert repository.count_chunks() == 0
+
+def test_migrations_can_be_applied_again():
+    # As after a crash that lost the version bump of already applied migrations
+    _create_baseline_database()
+    database.initialize_database()
+    database.get_db_connection().execute("PRAGMA user_version = 0")
+    database.close_db_connection()
+
+    database.initialize_database()
+    _assert_migrated()
@@ -0,0 +1,22 @@
+from filemind import database, hasher, repository
+
+def test_cached_embeddings_are_keyed_by_model():
+    database.initialize_database()
+    content_hash = hasher.generate_content_hash("some text")
+    repository.add_cached_embeddings("model-a", [(content_hash, b"a")])
+
+    assert repository.get_cached_embeddings("model-a", [content_hash]) == {content_hash: b"a"}
+    assert repository.get_cached_embeddings("model-b", [content_hash]) == {}
+
+def test_prune_embedding_cache(tmp_path):
+    database.initialize_database()
+    file_id = repository.add_file(tmp_path / "a.txt", None, 1, 1)
+    repository.add_chunks_bulk(file_id, ["live text"])
+    live = hasher.generate_content_hash("live text")
+    dead = hasher.generate_content_hash("deleted text")
+    repository.add_cached_embeddings("model-a", [(live, b"1"), (dead, b"2")])
+    repository.add_cached_embeddings("model-b", [(live, b"3")])
+
+    assert repository.prune_embedding_cache("model-a") == 2
+    assert repository.get_cached_embeddings("model-a", [live, dead]) == {live: b"1"}
+    assert repository.get_cached_embeddings("model-b", [live]) == {}
@@ -0,0 +1,25 @@
+from filemind import cli, database, hasher, repository
+
+def _stat(path):
+    stat = path.stat()
+    return stat.st_size, int(stat.st_mtime)
+
+def test_unchanged_text_without_hash_clears_stale_hash(tmp_path):
+    # Two identical files, hashed by the first scan
+    a = tmp_path / "a.txt"
+    b = tmp_path / "b.txt"
+    a.write_text("hello world foo bar")
+    b.write_text("hello world foo bar")
+    database.initialize_database()
+    file_hash = hasher.generate_file_hash(a, a.stat().st_size)
+    for path in (a, b):
+        repository.add_file(path, file_hash, *_stat(path))
+
+    # The bytes change but the normalized text doesn't, and 'scan --no-hash'
+    # keeps the file's chunks without hashing it
+    a.write_text("hello  world foo bar")
+    cli._commit_file(a, cli.PreparedFile(None, *_stat(a), None))
+
+    assert repository.get_all_file_stats()[str(a)][2] is None
+    assert str(a) in [file_path for _, file_path, _ in repository.get_files_missing_hash()]
+    assert list(repository.iter_duplicate_groups()) == []
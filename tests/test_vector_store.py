@@ -0,0 +1,28 @@
+import json
+
+import numpy as np
+
+from filemind import config, vector_store
+
+def _embeddings(n):
+    embeddings = np.random.default_rng(0).random((n, vector_store.EMBEDDING_DIM), dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+def test_save_records_last_chunk_id():
+    config.APP_DIR.mkdir(parents=True)
+    vs = vector_store.VectorStore()
+    assert vs.last_chunk_id == 0
+    vs.add(_embeddings(3), [4, 9, 7])
+    vs.save()
+
+    assert vector_store.VectorStore(readonly=True).last_chunk_id == 9
+
+def test_last_chunk_id_of_index_saved_without_it():
+    config.APP_DIR.mkdir(parents=True)
+    vs = vector_store.VectorStore()
+    vs.add(_embeddings(2), [3, 5])
+    vs.save()
+    with open(config.FAISS_INDEX_META_PATH, 'w') as f:
+        json.dump({'format_version': vector_store.INDEX_FORMAT_VERSION}, f)
+
+    assert vector_store.VectorStore().last_chunk_id == 5